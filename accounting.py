@@ -0,0 +1,116 @@
+import time
+from collections import defaultdict
+from collections.abc import Awaitable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TypeVar
+
+import metrics
+import tracing
+from experiment_model import LatencySummary, StageTiming
+
+T = TypeVar("T")
+
+# Timings of the request being handled, when something is collecting them
+_timings: ContextVar[list[StageTiming] | None] = ContextVar("timings", default=None)
+# The innermost stage running in this task, model calls charge their tokens to it
+_stage: ContextVar[StageTiming | None] = ContextVar("stage", default=None)
+
+
+@contextmanager
+def collect_timings() -> Iterator[list[StageTiming]]:
+    """Collect every stage timed (in this task and the tasks it spawns) until exit."""
+    timings: list[StageTiming] = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[StageTiming]:
+    """Time `stage` for the collected timings, the stage metrics and as a span."""
+    timing = StageTiming(stage=stage)
+    token = _stage.set(timing)
+    start = time.perf_counter()
+    with tracing.span(stage) as span:
+        try:
+            yield timing
+        finally:
+            timing.duration_seconds = time.perf_counter() - start
+            _stage.reset(token)
+            metrics.stage_duration.observe(timing.duration_seconds, stage=stage)
+            if timing.prompt_tokens or timing.completion_tokens:
+                span.attributes["llm.prompt_tokens"] = timing.prompt_tokens
+                span.attributes["llm.completion_tokens"] = timing.completion_tokens
+            timings = _timings.get()
+            if timings is not None:
+                timings.append(timing)
+
+
+async def timed_call(stage: str, awaitable: Awaitable[T]) -> T:
+    with timed(stage):
+        return await awaitable
+
+
+def add_tokens(prompt_tokens: int | None, completion_tokens: int | None) -> None:
+    stage = _stage.get()
+    if stage is not None:
+        stage.prompt_tokens += prompt_tokens or 0
+        stage.completion_tokens += completion_tokens or 0
+
+
+def token_shares(tokens: int | None, texts: list[str]) -> list[int]:
+    """`tokens` of a request with several `texts`, shared out by their length; the shares
+    add up to `tokens`."""
+    total = sum(len(text) for text in texts) or 1
+    shares, cumulative, previous = [], 0, 0
+    for text in texts:
+        cumulative += len(text)
+        current = round((tokens or 0) * cumulative / total)
+        shares.append(current - previous)
+        previous = current
+    return shares
+
+
+def record(timings: list[StageTiming], prefix: str = "") -> None:
+    """Add timings measured elsewhere (e.g. returned by System 2) to the current collection."""
+    collected = _timings.get()
+    if collected is not None:
+        collected.extend(
+            timing.model_copy(update={"stage": f"{prefix}{timing.stage}"})
+            for timing in timings
+        )
+
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    """Linearly interpolated percentile of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (
+        sorted_values[upper] - sorted_values[lower]
+    ) * (rank - lower)
+
+
+def summarize_latencies(timings: list[StageTiming]) -> dict[str, LatencySummary]:
+    by_stage: defaultdict[str, list[StageTiming]] = defaultdict(list)
+    for timing in timings:
+        by_stage[timing.stage].append(timing)
+
+    summaries = {}
+    for stage, stage_timings in sorted(by_stage.items()):
+        durations = sorted(timing.duration_seconds for timing in stage_timings)
+        summaries[stage] = LatencySummary(
+            count=len(durations),
+            total_seconds=sum(durations),
+            p50_seconds=percentile(durations, 50),
+            p95_seconds=percentile(durations, 95),
+            p99_seconds=percentile(durations, 99),
+            prompt_tokens=sum(timing.prompt_tokens for timing in stage_timings),
+            completion_tokens=sum(timing.completion_tokens for timing in stage_timings),
+        )
+    return summaries
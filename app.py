@@ -1,10 +1,10 @@
 import argparse
+import asyncio
 import json
-import math
-from collections import defaultdict, deque
+import time
+from collections import defaultdict
 from contextlib import asynccontextmanager
 from dataclasses import asdict
-from datetime import datetime, timezone
 from enum import StrEnum
 from pathlib import Path
 from typing import Any
@@ -12,50 +12,280 @@ from uuid import uuid4
 
 import httpx
 from bokeh.embed import components
-from bokeh.models import ColumnDataSource
-from bokeh.plotting import figure
 from fastapi import FastAPI, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
+from pydantic import BaseModel, ValidationError
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
+import accounting
+import llm
+import metrics
+import scheduler
 import system_one_model
 import system_two_model
+import tracing
+from accounting import collect_timings, timed
 from app_graph import create_system_two_node_graph
-from experiment_model import SystemOnePrompt, SystemOneResponse
-from history import create_database_and_table, record_interaction
+from charts import clean_values, generate_bar_chart, generate_chart
+from conversation import ContextConfiguration, ContextPolicy
+from escalation import EscalationConfiguration, activation, should_escalate
+from experiment_model import (
+    Experiment,
+    Experiments,
+    NewSession,
+    PromptResult,
+    SystemOnePrompt,
+    SystemOneResponse,
+)
+from history import record_interaction
+from knowledge_base import KnowledgeBase
 from metacognitive import (
     MetacognitiveVector,
+    compact_msv,
     compute_metacognitive_state_vector,
     generate_empty_msv,
+    get_weights,
+    judge_statistics,
 )
 from prompts import Prompts
+from scheduler import Priority, priority
+from sessions import Session, create_session
+from similarity import Scorer, ScorerConfiguration
+from system_two_configuration import SystemTwoConfiguration
+from static_assets import PrecompressedStaticFiles, bokeh_bundles
 from system_communication_objects import SystemTwoRequest
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--system-two", default=False, action="store_true")
 parser.add_argument("--system-two-url", required=False)
+parser.add_argument(
+    "--port", type=int, default=None, help="Default 8000, or 8001 with --system-two"
+)
+parser.add_argument(
+    "--configuration",
+    required=False,
+    help="JSON file with the startup configuration (weights, prompts, system_two), same shape as /reset",
+)
+parser.add_argument(
+    "--experiment-concurrency",
+    type=int,
+    default=4,
+    help="Experiments /experiments runs at once, across all requests",
+)
+parser.add_argument(
+    "--system-two-encoding",
+    choices=["json", "msgpack"],
+    default="json",
+    help="Body encoding of requests to System 2 (msgpack needs the msgpack package on both sides)",
+)
+parser.add_argument(
+    "--context-budget",
+    type=int,
+    default=2048,
+    help="Tokens of conversation history sent to System 1 with each prompt",
+)
+parser.add_argument(
+    "--context-policy",
+    choices=list(ContextPolicy),
+    default=ContextPolicy.Truncate,
+    help="What happens to messages over the context budget: dropped or summarized",
+)
+parser.add_argument(
+    "--digest-budget",
+    type=int,
+    default=512,
+    help="Tokens of earlier replies the judges compare a response against",
+)
+parser.add_argument(
+    "--knowledge-base",
+    required=False,
+    help="Index directory built with knowledge_base.py; without one, earlier replies stand in for the knowledge base",
+)
+parser.add_argument(
+    "--trace-file",
+    required=False,
+    help="Append spans to this file, one OTLP/JSON export request per line",
+)
+parser.add_argument(
+    "--otlp-endpoint",
+    required=False,
+    help="Export spans to this OTLP/HTTP collector, e.g. http://localhost:4318",
+)
+parser.add_argument(
+    "--cassette",
+    required=False,
+    help="sqlite file to record model calls to, or replay them from (see --cassette-mode)",
+)
+parser.add_argument(
+    "--cassette-mode",
+    choices=list(llm.CassetteMode),
+    default=llm.CassetteMode.Record,
+    help="record: call the model and keep every response; replay: answer only from the cassette",
+)
+parser.add_argument(
+    "--llm-slots",
+    type=int,
+    default=4,
+    help="Calls in flight per model, across all sessions; the rest wait by priority",
+)
+parser.add_argument(
+    "--model-slots",
+    nargs="*",
+    default=[],
+    metavar="MODEL=SLOTS",
+    help="Override --llm-slots for single models, e.g. llama3.1:8b=1",
+)
+parser.add_argument(
+    "--llm-queue-limit",
+    type=int,
+    default=256,
+    help="Calls that may wait per model before requests are refused with 503",
+)
+parser.add_argument(
+    "--judge-batch-window",
+    type=float,
+    default=5,
+    help="Milliseconds the similarity scorers' embedding calls are collected for, to send them to the model as one request (0 to not batch)",
+)
+parser.add_argument(
+    "--keep-alive",
+    default=None,
+    help="How long the model server keeps models loaded after their last call, e.g. 30m, or -1 for ever (default: the server's)",
+)
+parser.add_argument(
+    "--knowledge-base-top-k",
+    type=int,
+    default=3,
+    help="Knowledge base chunks retrieved per prompt",
+)
 app_args = parser.parse_args()
+context_configuration = ContextConfiguration(
+    budget_tokens=app_args.context_budget,
+    policy=app_args.context_policy,
+    digest_tokens=app_args.digest_budget,
+)
+knowledge_base = (
+    KnowledgeBase.load(app_args.knowledge_base) if app_args.knowledge_base else None
+)
+llm.use_cassette(app_args.cassette, app_args.cassette_mode)
+model_slots = {}
+for model_slot in app_args.model_slots:
+    model, _, slots = model_slot.rpartition("=")
+    if not model or not slots.isdigit():
+        parser.error(f"--model-slots expects MODEL=SLOTS, not {model_slot}")
+    model_slots[model] = int(slots)
+scheduler.configure(app_args.llm_slots, model_slots, app_args.llm_queue_limit)
+llm.use_batching(app_args.judge_batch_window / 1000)
+llm.use_keep_alive(app_args.keep_alive)
+if app_args.system_two_encoding == "msgpack" and msgpack is None:
+    parser.error("--system-two-encoding msgpack requires the msgpack package")
+
+
+# The models the configuration uses, loaded by `warming` before /ready reports ready
+warm_models: set[str] = set()
+warming: asyncio.Task | None = None
+
+
+def _referenced_models(
+    system_two: SystemTwoConfiguration, scorers: ScorerConfiguration
+) -> tuple[set[str], set[str]]:
+    """Chat models (System 1, the judges, System 2's roles and synthesis) and embedding
+    models"""
+    chat_models = {
+        llm.DEFAULT_MODEL,
+        system_two.synthesis_model,
+        *(role.model for role in system_two.roles.values()),
+    }
+    embedding_models = (
+        {scorers.embedding_model}
+        if Scorer.Embedding
+        in (scorers.experiential_matching, scorers.conflict_information)
+        else set()
+    )
+    return chat_models, embedding_models
+
+
+async def _warm_up(chat_models: set[str], embedding_models: set[str]) -> None:
+    """Load every model, one at a time, retrying until the model server is up."""
+    pending = [(model, False) for model in sorted(chat_models)] + [
+        (model, True) for model in sorted(embedding_models)
+    ]
+    while pending:
+        for model, embedding in list(pending):
+            try:
+                start = time.perf_counter()
+                await llm.warm_up(model, embedding)
+                print(f"Loaded {model} in {time.perf_counter() - start:.1f}s")
+                pending.remove((model, embedding))
+            except Exception as e:
+                print(f"Unable to load {model}, retrying: {e}")
+        if pending:
+            await asyncio.sleep(5)
+
+
+def _start_warm_up(
+    system_two: SystemTwoConfiguration, scorers: ScorerConfiguration
+) -> None:
+    global warm_models, warming
+    if llm.cassette is not None and llm.cassette.mode == llm.CassetteMode.Replay:
+        # no model to load
+        return
+    chat_models, embedding_models = _referenced_models(system_two, scorers)
+    warm_models = chat_models | embedding_models
+    if warming:
+        warming.cancel()
+    warming = asyncio.create_task(_warm_up(chat_models, embedding_models))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    if not app_args.system_two:
-        await reset_system()
+    configuration = None
+    if app_args.configuration:
+        configuration = json.loads(Path(app_args.configuration).read_text())
+    if app_args.system_two:
+        _, _, system_two, scorers, _ = _split_configuration(configuration)
+        _start_warm_up(system_two, scorers)
+    else:
+        # also starts the warm-up, for the new session's configuration
+        await reset_system(configuration)
+    span_exporter = tracing.configure(
+        "system_two" if app_args.system_two else "system_one",
+        app_args.trace_file,
+        app_args.otlp_endpoint,
+    )
+    exporting = asyncio.create_task(span_exporter.run()) if span_exporter else None
 
     yield
-    # cleanup/shutdown goes here, if necessary
+    if warming:
+        warming.cancel()
+    if exporting:
+        exporting.cancel()
+        await asyncio.gather(exporting, return_exceptions=True)
 
 
 app = FastAPI(lifespan=lifespan)
 
+static_files = PrecompressedStaticFiles(
+    directory="static", build_directory="build/static"
+)
+app.mount("/static", static_files, name="static")
 templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+templates.env.globals["hashed_asset"] = static_files.hashed_asset
 
 
 @app.post("/chat", response_class=HTMLResponse)
 async def chat(request: Request, user_input: str = Form(...)):
-    response, id = await run_system_one(user_input)
+    response, id = await run_system_one(user_input, ui_session)
     return f"""
 <div class="message is-bot" 
      hx-get="/get_chart?id={id}" 
@@ -85,6 +315,7 @@ async def get_chart(request: Request, id: str = None):
     msv_graphs = []
     msv_bar_graphs = []
     system_two_graph_components = ("", "")
+    bundles: set[str] = set()
 
     if id:
         for system_number, msv in enumerate(msv_state.get(id, [])):
@@ -93,8 +324,8 @@ async def get_chart(request: Request, id: str = None):
                 json.dumps(
                     asdict(msv)
                     | {
-                        "activation_result": msv._activation_function(
-                            msv.calculated_value
+                        "activation_result": activation(
+                            msv.calculated_value, ui_session.escalation
                         )
                     },
                     indent=2,
@@ -108,62 +339,62 @@ async def get_chart(request: Request, id: str = None):
                 "conflict_information": msv.conflict_information.calculated_value,
                 "problem_importance": msv.problem_importance.calculated_value,
             }
-            emotional_data = _clean_values(msv.emotional_response)
-            correctness_data = _clean_values(msv.correctness)
-            experiential_matching_data = _clean_values(msv.experiential_matching)
-            conflict_information_data = _clean_values(msv.conflict_information)
-            problem_importance_data = _clean_values(msv.problem_importance)
+            emotional_data = clean_values(msv.emotional_response)
+            correctness_data = clean_values(msv.correctness)
+            experiential_matching_data = clean_values(msv.experiential_matching)
+            conflict_information_data = clean_values(msv.conflict_information)
+            problem_importance_data = clean_values(msv.problem_importance)
 
             # Create a Bokeh plot
-            msv_components_chart = _generate_chart(
+            msv_components_chart = generate_chart(
                 data, "MSV Components", f"{system_label} MSV"
             )
-            emotion_chart = _generate_chart(
+            emotion_chart = generate_chart(
                 emotional_data, "Emotion Components", f"{system_label} Emotion Vector"
             )
-            correctness_chart = _generate_chart(
+            correctness_chart = generate_chart(
                 correctness_data,
                 "Correctness Components",
                 f"{system_label} Correctness Vector",
             )
-            experiential_chart = _generate_chart(
+            experiential_chart = generate_chart(
                 experiential_matching_data,
                 "Experiential Components",
                 f"{system_label} Experiential Vector",
             )
-            conflict_chart = _generate_chart(
+            conflict_chart = generate_chart(
                 conflict_information_data,
                 "Conflict Components",
                 f"{system_label} Conflict Vector",
             )
-            problem_importance_chart = _generate_chart(
+            problem_importance_chart = generate_chart(
                 problem_importance_data,
                 "Problem Importance Components",
                 f"{system_label} Problem Importance Vector",
             )
 
-            bar_msv_components_chart = _generate_bar_chart(
+            bar_msv_components_chart = generate_bar_chart(
                 data, "MSV Components", f"{system_label} MSV"
             )
-            bar_emotion_chart = _generate_bar_chart(
+            bar_emotion_chart = generate_bar_chart(
                 emotional_data, "Emotion Components", f"{system_label} Emotion Vector"
             )
-            bar_correctness_chart = _generate_bar_chart(
+            bar_correctness_chart = generate_bar_chart(
                 correctness_data,
                 "Correctness Components",
                 f"{system_label} Correctness Vector",
             )
-            bar_experiential_chart = _generate_bar_chart(
+            bar_experiential_chart = generate_bar_chart(
                 experiential_matching_data,
                 "Experiential Components",
                 f"{system_label} Experiential Vector",
             )
-            bar_conflict_chart = _generate_bar_chart(
+            bar_conflict_chart = generate_bar_chart(
                 conflict_information_data,
                 "Conflict Components",
                 f"{system_label} Conflict Vector",
             )
-            bar_problem_importance_chart = _generate_bar_chart(
+            bar_problem_importance_chart = generate_bar_chart(
                 problem_importance_data,
                 "Problem Importance Components",
                 f"{system_label} Problem Importance Vector",
@@ -192,12 +423,17 @@ async def get_chart(request: Request, id: str = None):
             )
             msv_graphs.append(parts)
             msv_bar_graphs.append(bar_parts)
+            # every radar/bar chart is built the same way, so one of each is representative
+            bundles.update(
+                bokeh_bundles([msv_components_chart, bar_msv_components_chart])
+            )
             if system_number == 1:
                 global selected_nodes
                 plot, selected_nodes = create_system_two_node_graph(
                     system_two_state[id]
                 )
                 system_two_graph_components = components(plot)
+                bundles.update(bokeh_bundles([plot]))
     return templates.TemplateResponse(
         request=request,
         name="msv_visualizer.html",
@@ -206,6 +442,7 @@ async def get_chart(request: Request, id: str = None):
             "msv_json": msv_response,
             "msv_bar_graphs": msv_bar_graphs,
             "system_two_graph": system_two_graph_components,
+            "bokeh_bundles": sorted(bundles),
         },
     )
 
@@ -224,164 +461,18 @@ async def node_detail(node_id: int):
     """
 
 
-excluded_keys = {"calculated_value", "version"}
-
-
-def _clean_values(value) -> dict[str, float]:
-    return {
-        k: v
-        for k, v in asdict(value).items()
-        if k not in excluded_keys and not k.startswith("weight_")
-    }
-
-
-def get_weights(msv: MetacognitiveVector) -> dict[str, float]:
-    weights = {}
-    for x in (
-        ("msv_weights", msv),
-        ("emotional_response", msv.emotional_response),
-        ("correctness", msv.correctness),
-        ("experiential_matching", msv.experiential_matching),
-        ("conflict_information", msv.conflict_information),
-        ("problem_importance", msv.problem_importance),
-    ):
-        weights[x[0]] = {
-            k: v
-            for k, v in asdict(x[1]).items()
-            if k.startswith("weight") or k == "activation_threshold"
-        }
-    return weights
-
-
-def _generate_bar_chart(
-    data: dict[str, float], x_label: str, chart_title: str
-) -> figure:
-    categories: list[str] = [
-        k.replace("_", " ")
-        .title()
-        .replace(" ", "\x00", 1)
-        .replace(" ", "\n", 1)
-        .replace("\x00", " ")
-        for k in data.keys()
-    ]
-    values: list[float] = list(data.values())
-    p = figure(
-        x_range=categories,
-        # All vectors are on the 0-100 interval
-        y_range=(0, 100),
-        title=chart_title,
-        toolbar_location=None,
-        tools="",
-    )
-    p.vbar(x=categories, top=values, width=0.9)
-
-    p.xgrid.grid_line_color = None
-    p.y_range.start = 0
-    p.xaxis.axis_label = x_label
-    p.yaxis.axis_label = "Values"
-    return p
-
-
-def _generate_chart(data: dict[str, float], x_label: str, chart_title: str) -> figure:
-    categories: list[str] = [
-        k.replace("_", " ")
-        .title()
-        .replace(" ", "\x00", 1)
-        .replace(" ", "\n", 1)
-        .replace("\x00", " ")
-        for k in data.keys()
-    ]
-    # categories: list[str] = list([k.replace("_", " ").title() for k in data.keys()])
-    values: list[float] = list(data.values())
-
-    num_vars = len(categories)
-
-    # Calculate angles for each axis (in radians)
-    angles = [i * 2 * math.pi / num_vars for i in range(num_vars)]
-    angles.append(angles[0])  # Close the polygon
-
-    # Close the values list to complete the polygon
-    closed_values = values + [values[0]]
-
-    # Convert polar coordinates to cartesian
-    max_val = 100  # Your data is on 0-100 scale
-    x = [val * math.cos(angle) for val, angle in zip(closed_values, angles)]
-    y = [val * math.sin(angle) for val, angle in zip(closed_values, angles)]
-
-    # Create axis lines from center to perimeter
-    axis_x = [[0, max_val * math.cos(angle)] for angle in angles[:-1]]
-    axis_y = [[0, max_val * math.sin(angle)] for angle in angles[:-1]]
-
-    # Position labels outside the chart
-    label_distance = max_val * 1.15
-    label_x = [label_distance * math.cos(angle) for angle in angles[:-1]]
-    label_y = [label_distance * math.sin(angle) for angle in angles[:-1]]
-
-    # Create data sources
-    polygon_source = ColumnDataSource(data=dict(x=x, y=y))
-    axis_source = ColumnDataSource(data=dict(xs=axis_x, ys=axis_y))
-    label_source = ColumnDataSource(data=dict(x=label_x, y=label_y, text=categories))
-
-    # Create figure
-    p = figure(
-        width=500,
-        height=500,
-        title=chart_title,
-        toolbar_location=None,
-        tools="",
-        match_aspect=True,
-        x_range=(-max_val * 1.7, max_val * 1.7),
-        y_range=(-max_val * 1.7, max_val * 1.7),
-    )
-
-    # Hide axes and grid
-    p.xaxis.visible = False
-    p.yaxis.visible = False
-    p.xgrid.visible = False
-    p.ygrid.visible = False
-
-    # Draw axis lines (spokes)
-    p.multi_line(xs="xs", ys="ys", source=axis_source, color="#cccccc", line_width=1)
-
-    # Draw concentric circles for reference (optional)
-    circle_radii = [25, 50, 75, 100]
-    for radius in circle_radii:
-        circle_angles = [i * 2 * math.pi / 100 for i in range(101)]
-        circle_x = [radius * math.cos(a) for a in circle_angles]
-        circle_y = [radius * math.sin(a) for a in circle_angles]
-        p.line(circle_x, circle_y, color="#eeeeee", line_width=1, alpha=0.5)
-
-    # Draw the data polygon
-    p.patch(
-        x="x",
-        y="y",
-        source=polygon_source,
-        alpha=0.3,
-        color="#3298dc",
-        line_color="#2366d1",
-        line_width=2,
-    )
-
-    # Add category labels
-    p.text(
-        x="x",
-        y="y",
-        text="text",
-        source=label_source,
-        text_align="center",
-        text_baseline="middle",
-        text_font_size="10pt",
-    )
-
-    return p
-
-
 @app.post("/system1")
 async def run_experiment(
     request: Request, system_one_prompt: SystemOnePrompt
 ) -> SystemOneResponse:
-    response = await run_system_one(system_one_prompt.user_input)
-    return SystemOneResponse(response=response, session_id=session_id)
+    session = _get_session(system_one_prompt.session_id)
+    with collect_timings() as timings, priority(Priority.Experiment):
+        response, _ = await run_system_one(
+            system_one_prompt.user_input, session, save_state=False
+        )
+    return SystemOneResponse(
+        response=response, session_id=session.session_id, timings=timings
+    )
 
 
 def save_msv_state(msv_system_one, msv_system_two: MetacognitiveVector) -> str:
@@ -392,64 +483,122 @@ def save_msv_state(msv_system_one, msv_system_two: MetacognitiveVector) -> str:
     return id
 
 
-prompts = Prompts()
-history = deque(maxlen=10)
+system_two_client = httpx.AsyncClient(timeout=None)
+# settings ids System 2 has accepted, so later requests can leave the settings out
+system_two_known_settings: set[str] = set()
 
 
-async def run_system_one(user_input: str) -> tuple[str, str]:
+def _encode_system_two_request(request: SystemTwoRequest) -> tuple[bytes, str]:
+    if app_args.system_two_encoding == "msgpack":
+        return (
+            msgpack.packb(request.model_dump(mode="json")),
+            "application/msgpack",
+        )
+    # None values are kept, or e.g. a disabled `stop_correctness` would arrive as its default
+    return request.model_dump_json().encode(), "application/json"
+
+
+async def _post_to_system_two(
+    session: Session, request: SystemTwoRequest
+) -> httpx.Response:
+    if request.settings_id not in system_two_known_settings:
+        request.settings = session.system_two_settings
+    content, content_type = _encode_system_two_request(request)
+    headers = {"Content-Type": content_type}
+    if traceparent := tracing.traceparent():
+        headers["traceparent"] = traceparent
+    # so System 2 knows e.g. experiment work from interactive work
+    headers["X-Priority"] = scheduler.current_priority().label
+    response = await system_two_client.post(
+        f"{app_args.system_two_url}/system2", content=content, headers=headers
+    )
+    if response.status_code == 409 and request.settings is None:
+        # System 2 lost its cache (e.g. restarted), send the settings along after all
+        system_two_known_settings.discard(request.settings_id)
+        return await _post_to_system_two(session, request)
+    response.raise_for_status()
+    system_two_known_settings.add(request.settings_id)
+    return response
+
+
+@tracing.traced("run_system_one")
+async def run_system_one(
+    user_input: str, session: Session, save_state: bool = True
+) -> tuple[str, str | None]:
     try:
-        global prompts
-        global weights
+        conversation = session.conversation
 
         # Generate a response from the system one model and compute the metacognative state vector
-        response = await system_one_model.get_response(user_input, list(history))
-        historical_info = "\n".join(
-            [
-                message["content"]
-                for message in history
-                if message["role"] == "assistant"
-            ]
-        )
+        with timed("system_one"):
+            response = await system_one_model.get_response(
+                user_input, conversation.context()
+            )
+        historical_info = conversation.historical_responses
+        knowledge = historical_info
+        if knowledge_base:
+            with timed("knowledge_base"):
+                knowledge = "\n\n".join(
+                    chunk.text
+                    for chunk in knowledge_base.search(
+                        user_input, app_args.knowledge_base_top_k
+                    )
+                )
         state = await compute_metacognitive_state_vector(
-            prompts=prompts,
-            weights=weights,
+            prompts=session.prompts,
+            weights=session.weights,
             response=response,
             original_prompt=user_input,
-            knowledge_base=historical_info,
+            knowledge_base=knowledge,
             historical_responses=historical_info,
+            scorers=session.scorers,
         )
 
         parsed_response = system_two_model.SystemTwoResponse(
             system_two_response=None, metacognitive_vector=None, node_responses=None
         )
-        if state.should_engage_system_two():
-            system_two_response = httpx.post(
-                f"{app_args.system_two_url}/system2",
-                content=SystemTwoRequest(
+        escalate = should_escalate(state, session.escalation)
+        metrics.system_one_turns.inc(escalated=str(escalate).lower())
+        if escalate:
+            try:
+                with timed("system_two"):
+                    system_two_response = await _post_to_system_two(
+                        session,
+                        SystemTwoRequest(
+                            user_prompt=user_input,
+                            system_one_response=response,
+                            metacognitive_vector=compact_msv(state),
+                            settings_id=session.system_two_settings_id,
+                        ),
+                    )
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 503:
+                    raise
+                # System 2 is overloaded, System 1's answer will have to do this time
+                print(f"System 2 overloaded, answering with System 1: {e}")
+            else:
+                parsed_response = (
+                    system_two_model.SystemTwoResponse.model_validate_json(
+                        system_two_response.text
+                    )
+                )
+                accounting.record(parsed_response.timings, prefix="system_two/")
+
+        if session.session_id:
+            with timed("db_write"):
+                record_interaction(
+                    db_file=session.db_file,
                     user_prompt=user_input,
                     system_one_response=response,
-                    metacognitive_vector=state,
-                    prompts=prompts,
-                    weights=weights,
-                ).model_dump_json(),
-                timeout=None,
-            )
-            parsed_response = system_two_model.SystemTwoResponse.model_validate_json(
-                system_two_response.text
-            )
-
-        if session_id:
-            record_interaction(
-                db_file=f"data/{session_id}.sqlite3",
-                user_prompt=user_input,
-                system_one_response=response,
-                system_one_msv=state,
-                system_two_response=parsed_response.system_two_response,
-                system_two_msv=parsed_response.metacognitive_vector,
-            )
-        id = save_msv_state(state, parsed_response.metacognitive_vector)
-        system_two_state[id] = parsed_response
-        history.append({"role": "user", "content": user_input})
+                    system_one_msv=state,
+                    system_two_response=parsed_response.system_two_response,
+                    system_two_msv=parsed_response.metacognitive_vector,
+                )
+        # chart state is only kept for interactive use, batch runs would just accumulate it
+        id = None
+        if save_state:
+            id = save_msv_state(state, parsed_response.metacognitive_vector)
+            system_two_state[id] = parsed_response
+        await conversation.append("user", user_input)
         system_response = (
             (
                 parsed_response.system_two_response
@@ -458,61 +607,272 @@ async def run_system_one(user_input: str) -> tuple[str, str]:
             ),
             id,
         )
-        history.append({"role": "assistant", "content": system_response[0]})
+        await conversation.append("assistant", system_response[0])
 
         return system_response
+    except scheduler.Overloaded as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": "1"}
+        )
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# shared by every /experiments request, so the server bounds its own load
+experiment_slots = asyncio.Semaphore(app_args.experiment_concurrency)
+
+
+async def _run_experiment_in_process(
+    experiment: Experiment, results: asyncio.Queue
+) -> None:
+    try:
+        async with experiment_slots:
+            with priority(Priority.Experiment):
+                session = create_session(
+                    *_split_configuration(None), set(sessions), context_configuration
+                )
+                # prompts of one experiment are one conversation, so they run strictly in order
+                for prompt_index, prompt in enumerate(experiment.prompts):
+                    response = error = None
+                    start = time.perf_counter()
+                    with collect_timings() as timings:
+                        try:
+                            response, _ = await run_system_one(
+                                prompt, session, save_state=False
+                            )
+                        except HTTPException as e:
+                            error = str(e.detail)
+                    await results.put(
+                        PromptResult(
+                            experiment_id=experiment.id,
+                            session_id=session.session_id,
+                            prompt_index=prompt_index,
+                            prompt_count=len(experiment.prompts),
+                            response=response,
+                            error=error,
+                            duration_seconds=time.perf_counter() - start,
+                            timings=timings,
+                        )
+                    )
+    finally:
+        # tells the stream this experiment is done
+        await results.put(None)
+
+
+@app.post("/experiments")
+async def run_experiments_in_process(experiments: Experiments) -> StreamingResponse:
+    """Run a whole experiments document, streaming one PromptResult per line (NDJSON)"""
+
+    async def stream_results():
+        results: asyncio.Queue[PromptResult | None] = asyncio.Queue()
+        tasks = [
+            asyncio.create_task(_run_experiment_in_process(experiment, results))
+            for experiment in experiments.experiments
+        ]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                result = await results.get()
+                if result is None:
+                    remaining -= 1
+                    continue
+                yield result.model_dump_json() + "\n"
+        finally:
+            # the client went away, don't keep running its experiments
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
 @app.post("/system2")
-async def run_system_two(
-    system_two_request: SystemTwoRequest,
-) -> system_two_model.SystemTwoResponse:
+async def run_system_two(request: Request) -> system_two_model.SystemTwoResponse:
     # This requires running a second instance with the `--system-two`` flag:
-    return await system_two_model.get_response(system_two_request)
+    body = await request.body()
+    try:
+        if request.headers.get("content-type") == "application/msgpack":
+            if msgpack is None:
+                raise HTTPException(status_code=415, detail="msgpack is not installed")
+            system_two_request = SystemTwoRequest.model_validate(msgpack.unpackb(body))
+        else:
+            system_two_request = SystemTwoRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422, detail=e.errors(include_url=False, include_context=False)
+        )
+
+    caller_priority = Priority.from_label(
+        request.headers.get("X-Priority"), Priority.System_Two
+    )
+    with collect_timings() as timings, tracing.continue_trace(
+        request.headers.get("traceparent")
+    ), priority(max(caller_priority, Priority.System_Two)):
+        try:
+            response = await system_two_model.get_response(system_two_request)
+        except system_two_model.UnknownSettingsError:
+            raise HTTPException(
+                status_code=409, detail="Unknown settings id, resend with settings"
+            )
+        except system_two_model.SettingsMismatchError:
+            raise HTTPException(
+                status_code=422, detail="Settings don't match their settings id"
+            )
+        except scheduler.Overloaded as e:
+            raise HTTPException(
+                status_code=503, detail=str(e), headers={"Retry-After": "1"}
+            )
+    response.timings = timings
+    return response
+
+
+@app.get("/judge_statistics")
+async def get_judge_statistics() -> dict[str, dict[str, int]]:
+    """Judge calls per MSV dimension, and how many answers had to be retried or thrown away"""
+    return {
+        dimension: asdict(statistics)
+        for dimension, statistics in judge_statistics.items()
+    }
+
+
+@app.get("/ready")
+async def ready() -> JSONResponse:
+    """200 once every model the configuration uses is loaded, 503 until then (and when
+    one was unloaded since), e.g. to hold back a load balancer."""
+    models = dict.fromkeys(sorted(warm_models), False)
+    if warming is not None and warming.done():
+        try:
+            resident = await llm.resident_models()
+        except Exception as e:
+            print(f"Unable to list the loaded models: {e}")
+            resident = set()
+        models = {model: llm.tagged(model) in resident for model in models}
+    is_ready = all(models.values()) and (warming is None or warming.done())
+    return JSONResponse(
+        {"ready": is_ready, "models": models}, status_code=200 if is_ready else 503
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    """Stage latencies, model calls and tokens, cache hits and escalations, for Prometheus"""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
-    weights_and_prompts = weights | {"prompts": prompts.model_dump()}
     return templates.TemplateResponse(
-        "index.html", {"request": request, "weights_and_prompts": weights_and_prompts}
+        request=request,
+        name="index.html",
+        context={"weights_and_prompts": ui_session.configuration},
     )
 
 
-session_id: str | None = None
-weights: dict[str, dict[str, float]] | None = None
+# configuration sections besides prompts and weights, by key
+_configuration_sections: dict[str, type[BaseModel]] = {
+    "system_two": SystemTwoConfiguration,
+    "scorers": ScorerConfiguration,
+    "escalation": EscalationConfiguration,
+}
 
 
-@app.post("/reset", response_class=HTMLResponse)
-async def reset_system(configuration: dict[str, dict[str, Any]] | None = None) -> None:
-    utc_now = datetime.now(timezone.utc)
-    formatted_datetime = utc_now.strftime("%Y-%m-%d_%H_%M_%S_%f")
-    data_directory = Path("data")
-    data_directory.mkdir(parents=True, exist_ok=True)
+def _current_section(name: str, section_type: type[BaseModel]) -> BaseModel:
+    return getattr(ui_session, name) if ui_session else section_type()
+
+
+# All live sessions by id; the web UI drives `ui_session`, experiments create their own
+sessions: dict[str, Session] = {}
+ui_session: Session | None = None
+
+
+def _get_session(session_id: str | None) -> Session:
+    if session_id is None:
+        return ui_session
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail=f"Unknown session {session_id}")
+    return sessions[session_id]
 
-    global prompts
-    global weights
-    if not weights and not configuration:
-        weights = get_weights(generate_empty_msv())
 
+def _split_configuration(
+    configuration: dict[str, dict[str, Any]] | None,
+) -> tuple[
+    Prompts,
+    dict[str, dict[str, float]],
+    SystemTwoConfiguration,
+    ScorerConfiguration,
+    EscalationConfiguration,
+]:
     if configuration:
-        prompts = Prompts(**configuration["prompts"])
         weights = configuration.copy()
-        del weights["prompts"]
-    current_configuration = weights | {"prompts": prompts.model_dump()}
-    created = create_database_and_table(
-        f"data/{formatted_datetime}.sqlite3", current_configuration
+        prompts = Prompts(**weights.pop("prompts"))
+        # a configuration without some of these sections (e.g. from the weights form) keeps
+        # the current ones
+        sections = []
+        try:
+            for name, section_type in _configuration_sections.items():
+                section = weights.pop(name, None)
+                sections.append(
+                    section_type.model_validate(section)
+                    if section is not None
+                    else _current_section(name, section_type)
+                )
+        except ValidationError as e:
+            raise HTTPException(
+                status_code=422,
+                detail=e.errors(include_url=False, include_context=False),
+            )
+        return prompts, weights, *sections
+    if ui_session:
+        return (
+            ui_session.prompts,
+            ui_session.weights,
+            *(getattr(ui_session, name) for name in _configuration_sections),
+        )
+    return (
+        Prompts(),
+        get_weights(generate_empty_msv()),
+        *(section_type() for section_type in _configuration_sections.values()),
+    )
+
+
+@app.post("/sessions")
+async def open_session(
+    configuration: dict[str, dict[str, Any]] | None = None,
+) -> NewSession:
+    """Create an isolated session (own history and database), e.g. one per experiment"""
+    session = create_session(
+        *_split_configuration(configuration), set(sessions), context_configuration
+    )
+    if not session.session_id:
+        raise HTTPException(status_code=500, detail="Unable to create session database")
+    sessions[session.session_id] = session
+    return NewSession(session_id=session.session_id)
+
+
+@app.delete("/sessions/{session_id}")
+async def close_session(session_id: str) -> None:
+    if ui_session and session_id == ui_session.session_id:
+        raise HTTPException(status_code=409, detail="Use /reset for the UI session")
+    sessions.pop(session_id, None)
+
+
+@app.post("/reset", response_class=HTMLResponse)
+async def reset_system(configuration: dict[str, dict[str, Any]] | None = None) -> None:
+    global ui_session
+    new_session = create_session(
+        *_split_configuration(configuration), set(sessions), context_configuration
     )
+    if ui_session and ui_session.session_id:
+        sessions.pop(ui_session.session_id, None)
+    ui_session = new_session
+    if ui_session.session_id:
+        sessions[ui_session.session_id] = ui_session
     msv_state.clear()
     system_two_state.clear()
-    history.clear()
+    _start_warm_up(ui_session.system_two, ui_session.scorers)
 
-    if created:
-        global session_id
-        session_id = formatted_datetime
     return f"""
 <div class="notification is-success">
     <button class="delete"></button>
@@ -531,5 +891,5 @@ async def reset_system(configuration: dict[str, dict[str, Any]] | None = None) -
 if __name__ == "__main__":
     import uvicorn
 
-    port = "8000" if not app_args.system_two else "8001"
+    port = app_args.port or (8000 if not app_args.system_two else 8001)
     uvicorn.run(app, host="0.0.0.0", port=port)
@@ -13,7 +13,12 @@ from bokeh.models import (
 )
 from bokeh.plotting import figure
 
-from system_two_model import NodeResponse, NodeRole, SystemTwoResponse
+from system_two_model import (
+    DeliberationDecision,
+    NodeResponse,
+    NodeRole,
+    SystemTwoResponse,
+)
 
 
 def create_system_two_node_graph(
@@ -28,7 +33,12 @@ def create_system_two_node_graph(
         if not has_synthesizer_role and node_response.node_role == NodeRole.Synthesizer:
             has_synthesizer_role = True
         system_two_nodes.append(node_response)
-    if not has_synthesizer_role:
+    stopped_early = (
+        system_two_state.deliberation
+        and system_two_state.deliberation[-1].decision == DeliberationDecision.Stop
+    )
+    # an early stop answers with the last node, there's no separate synthesis to show
+    if not has_synthesizer_role and not stopped_early:
         system_two_nodes.append(
             NodeResponse(
                 node_role=NodeRole.Synthesizer,
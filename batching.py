@@ -0,0 +1,101 @@
+"""Micro-batching of embedding calls across sessions.
+
+Embedding calls arriving within `window` seconds of each other are sent to the model as one
+request with all the texts, which the model server embeds together. Every call still gets
+exactly the embeddings it would have got alone.
+
+Chats aren't batched: ollama's chat API takes one conversation per request, so holding chats
+back to send them at the same time only adds the window to their latency. How many chats
+are in flight at once is up to the scheduler's slots.
+"""
+
+import asyncio
+import contextvars
+from collections.abc import Awaitable, Callable
+
+import ollama
+
+from accounting import token_shares
+from scheduler import current_priority
+
+SendEmbed = Callable[[str, list[str]], Awaitable[ollama.EmbedResponse]]
+
+
+class _Call:
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        # the caller's, so scheduling priority and spans carry over to the batch
+        self.context = contextvars.copy_context()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class _Batch:
+    def __init__(self):
+        self.calls: list[_Call] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        send_embed: SendEmbed,
+        window: float = 0.005,
+        max_batch: int = 32,
+    ):
+        self.send_embed = send_embed
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: dict[str, _Batch] = {}
+        self.batches: set[asyncio.Task] = set()
+
+    async def embed(self, model: str, texts: list[str]) -> ollama.EmbedResponse:
+        call = _Call(texts)
+        if model not in self.pending:
+            batch = self.pending[model] = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(
+                self.window, self._flush, model
+            )
+        batch = self.pending[model]
+        batch.calls.append(call)
+        if len(batch.calls) >= self.max_batch:
+            self._flush(model)
+        return await call.future
+
+    def _flush(self, model: str) -> None:
+        batch = self.pending.pop(model)
+        batch.timer.cancel()
+        task = asyncio.create_task(self._send_embeddings(model, batch.calls))
+        self.batches.add(task)
+        task.add_done_callback(self.batches.discard)
+
+    async def _send_embeddings(self, model: str, batch: list[_Call]) -> None:
+        # leaving out callers that gave up waiting
+        batch = [call for call in batch if not call.future.done()]
+        if not batch:
+            return
+        texts = [text for call in batch for text in call.texts]
+        # waits for its slot as the most urgent of the callers
+        first = min(batch, key=lambda call: call.context.run(current_priority))
+        try:
+            response = await asyncio.create_task(
+                self.send_embed(model, texts), context=first.context
+            )
+        except Exception as e:
+            for call in batch:
+                if not call.future.done():
+                    call.future.set_exception(e)
+            return
+        # the prompt tokens are shared out by length, for accounting
+        shares = token_shares(response.prompt_eval_count, texts)
+        start = 0
+        for call in batch:
+            end = start + len(call.texts)
+            if not call.future.done():
+                call.future.set_result(
+                    ollama.EmbedResponse(
+                        model=response.model,
+                        embeddings=response.embeddings[start:end],
+                        prompt_eval_count=sum(shares[start:end]),
+                    )
+                )
+            start = end
@@ -0,0 +1,199 @@
+"""A stand-in for the ollama server, answering /api/chat and /api/embed with scripted latency.
+
+Point the app at it with OLLAMA_HOST, so every code path runs as it would against a real
+model, without one:
+
+    python -m benchmarks.fake_llm --port 11435 --latency-ms 80 --tokens-per-second 40
+    OLLAMA_HOST=http://127.0.0.1:11435 python app.py ...
+"""
+
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from pydantic import BaseModel
+
+WORDS = (
+    "the model considers each part of the question and weighs what is known against "
+    "what is uncertain before it settles on an answer that fits the context"
+).split()
+EMBEDDING_DIMENSIONS = 64
+
+
+class FakeModelConfiguration(BaseModel):
+    # median time before the first token, log-normally distributed with `latency_sigma`
+    latency_ms: float = 50.0
+    latency_sigma: float = 0.5
+    # prompt processing and generation speed
+    prompt_tokens_per_second: float = 2000.0
+    tokens_per_second: float = 200.0
+    # reply lengths are uniform within ±50% of this, capped by num_predict
+    completion_tokens: int = 64
+    # requests the model works on at once, like OLLAMA_NUM_PARALLEL; the rest queue
+    slots: int = 4
+    seed: int | None = None
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class FakeModel:
+    def __init__(self, configuration: FakeModelConfiguration):
+        self.configuration = configuration
+        self.random = random.Random(configuration.seed)
+        self.slots = asyncio.Semaphore(configuration.slots)
+
+    async def run(self, prompt_tokens: int, completion_tokens: int) -> None:
+        configuration = self.configuration
+        delay = (
+            configuration.latency_ms
+            / 1000
+            * math.exp(self.random.gauss(0, configuration.latency_sigma))
+            + prompt_tokens / configuration.prompt_tokens_per_second
+            + completion_tokens / configuration.tokens_per_second
+        )
+        async with self.slots:
+            await asyncio.sleep(delay)
+
+    def completion_length(self, num_predict: int | None) -> int:
+        target = self.configuration.completion_tokens
+        length = self.random.randint(max(target // 2, 1), max(target * 3 // 2, 1))
+        return min(length, num_predict) if num_predict else length
+
+    def reply(self, format: dict | str | None, num_predict: int | None) -> str:
+        if isinstance(format, dict) and "properties" in format:
+            # a judge asking for scores: fill in the schema
+            return "{%s}" % ", ".join(
+                f'"{name}": {self.random.randint(0, 100)}'
+                for name in format["properties"]
+            )
+        return " ".join(
+            self.random.choice(WORDS)
+            for _ in range(self.completion_length(num_predict))
+        )
+
+
+def embedding(text: str) -> list[float]:
+    """Deterministic unit vector per text, so identical texts are identical vectors."""
+    digest = hashlib.sha256(text.encode()).digest()
+    generator = random.Random(digest)
+    vector = [generator.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector]
+
+
+def create_app(configuration: FakeModelConfiguration) -> FastAPI:
+    app = FastAPI()
+    model = FakeModel(configuration)
+    # every model asked for, as if loaded
+    loaded: set[str] = set()
+
+    @app.get("/")
+    async def alive() -> str:
+        return "Ollama is running"
+
+    @app.post("/api/chat")
+    async def chat(request: Request) -> dict:
+        body = await request.json()
+        loaded.add(body.get("model", ""))
+        options = body.get("options") or {}
+        content = model.reply(body.get("format"), options.get("num_predict"))
+        prompt_tokens = sum(
+            estimate_tokens(message.get("content") or "")
+            for message in body.get("messages", [])
+        )
+        completion_tokens = estimate_tokens(content)
+        await model.run(prompt_tokens, completion_tokens)
+        return {
+            "model": body.get("model", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": completion_tokens,
+        }
+
+    @app.post("/api/embed")
+    async def embed(request: Request) -> dict:
+        body = await request.json()
+        loaded.add(body.get("model", ""))
+        texts = body.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        prompt_tokens = sum(estimate_tokens(text) for text in texts)
+        await model.run(prompt_tokens, 0)
+        return {
+            "model": body.get("model", ""),
+            "embeddings": [embedding(text) for text in texts],
+            "prompt_eval_count": prompt_tokens,
+        }
+
+    @app.get("/api/ps")
+    async def ps() -> dict:
+        return {
+            "models": [
+                {"name": name, "model": name if ":" in name else f"{name}:latest"}
+                for name in sorted(loaded)
+            ]
+        }
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeModelConfiguration()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument(
+        "--prompt-tokens-per-second",
+        type=float,
+        default=defaults.prompt_tokens_per_second,
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=defaults.tokens_per_second
+    )
+    parser.add_argument(
+        "--completion-tokens", type=int, default=defaults.completion_tokens
+    )
+    parser.add_argument(
+        "--slots",
+        type=int,
+        default=defaults.slots,
+        help="Requests the fake model serves at once",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def configuration_from_arguments(args: argparse.Namespace) -> FakeModelConfiguration:
+    return FakeModelConfiguration(
+        **{
+            name: getattr(args, name)
+            for name in FakeModelConfiguration.model_fields
+            if hasattr(args, name)
+        }
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake ollama server for load tests")
+    parser.add_argument("--port", type=int, default=11435)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(configuration_from_arguments(args)),
+        host="127.0.0.1",
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
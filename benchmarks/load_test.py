@@ -0,0 +1,436 @@
+"""End-to-end load test of the real app (System 1 and System 2) against `fake_llm`.
+
+Starts the fake model server and both app instances, drives /chat, /system1 and /system2
+at a given concurrency and reports throughput with p50/p95/p99 per pipeline stage:
+
+    python -m benchmarks.load_test --requests 200 --concurrency 8 --output baseline.json
+    python -m benchmarks.load_test --requests 200 --concurrency 8 --baseline baseline.json
+
+With --baseline the run is compared against an earlier one and the exit status is 1 if
+any stage or the throughput regressed by more than --tolerance.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import httpx
+from pydantic import BaseModel
+
+from accounting import summarize_latencies
+from benchmarks import fake_llm
+from experiment_model import (
+    LatencySummary,
+    NewSession,
+    StageTiming,
+    SystemOnePrompt,
+    SystemOneResponse,
+)
+from metacognitive import compact_msv, generate_empty_msv, get_weights
+from prompts import Prompts
+from system_communication_objects import (
+    SystemTwoRequest,
+    SystemTwoSettings,
+    settings_id,
+)
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+# one line per request drowns out the progress
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+TARGETS = ("chat", "system1", "system2")
+PROMPTS = (
+    "What is the boiling point of water at the top of Mount Everest?",
+    "Should I refinance my mortgage if rates drop by half a percent?",
+    "Summarize the causes of the French Revolution in three sentences.",
+    "My code throws a KeyError only in production, where do I start?",
+    "Is it safe to take ibuprofen together with a cold medicine?",
+    "Write a short poem about commuting in the rain.",
+)
+
+
+class TargetResult(BaseModel):
+    requests: int
+    errors: int
+    duration_seconds: float
+    throughput_per_second: float
+    # per stage, plus "round_trip" for the whole request as seen by the load test
+    latency_summary: dict[str, LatencySummary]
+
+
+class LoadTestResult(BaseModel):
+    started: str
+    # the load test's arguments, so runs are only compared like for like
+    parameters: dict[str, Any]
+    targets: dict[str, TargetResult]
+
+
+class Regression(BaseModel):
+    target: str
+    metric: str
+    baseline: float
+    current: float
+
+
+def _start(arguments: list[str], port: int, log_dir: Path, name: str, env: dict):
+    log = open(log_dir / f"{name}.log", "w")
+    process = subprocess.Popen(
+        [sys.executable, *arguments, "--port", str(port)],
+        cwd=REPOSITORY,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    return process
+
+
+async def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with {process.returncode}")
+            try:
+                if (await client.get(url)).is_success:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def _system_two_request(prompt: str, with_settings: bool) -> bytes:
+    msv = generate_empty_msv()
+    settings = SystemTwoSettings(prompts=Prompts(), weights=get_weights(msv))
+    request = SystemTwoRequest(
+        user_prompt=prompt,
+        system_one_response=f"A first, quick answer to: {prompt}",
+        metacognitive_vector=compact_msv(msv),
+        settings_id=settings_id(settings),
+        settings=settings if with_settings else None,
+    )
+    return request.model_dump_json(exclude_none=True).encode()
+
+
+async def _send(
+    client: httpx.AsyncClient, target: str, prompt: str, session_id: str | None
+) -> list[StageTiming]:
+    """One request to `target`, returning the stages the app reports for it."""
+    if target == "chat":
+        response = await client.post("/chat", data={"user_input": prompt})
+        response.raise_for_status()
+        return []
+    if target == "system1":
+        response = await client.post(
+            "/system1",
+            json=SystemOnePrompt(user_input=prompt, session_id=session_id).model_dump(),
+        )
+        response.raise_for_status()
+        return SystemOneResponse.model_validate(response.json()).timings
+    response = await client.post(
+        "/system2",
+        content=_system_two_request(prompt, with_settings=False),
+        headers={"Content-Type": "application/json"},
+    )
+    response.raise_for_status()
+    return [StageTiming(**timing) for timing in response.json()["timings"]]
+
+
+async def run_target(
+    client: httpx.AsyncClient,
+    target: str,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> TargetResult:
+    prompts = itertools.cycle(PROMPTS)
+    if target == "system2":
+        # System 2 caches the settings, later requests leave them out as System 1 does
+        response = await client.post(
+            "/system2",
+            content=_system_two_request(next(prompts), with_settings=True),
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+
+    timings: list[StageTiming] = []
+    errors = 0
+    remaining = iter(range(warmup + requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        session_id = None
+        if target == "system1":
+            # like the experiment harness, each worker is its own conversation
+            response = await client.post("/sessions")
+            response.raise_for_status()
+            session_id = NewSession.model_validate(response.json()).session_id
+        for index in remaining:
+            start = time.perf_counter()
+            try:
+                stages = await _send(client, target, next(prompts), session_id)
+            except httpx.HTTPError as e:
+                logging.warning(f"{target} request {index} failed: {e}")
+                errors += index >= warmup
+                continue
+            if index >= warmup:
+                timings.extend(stages)
+                timings.append(
+                    StageTiming(
+                        stage="round_trip", duration_seconds=time.perf_counter() - start
+                    )
+                )
+        if session_id:
+            await client.delete(f"/sessions/{session_id}")
+
+    logging.info(f"Driving /{target}: {requests} requests, concurrency {concurrency}")
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+    # the warm-up requests are in the wall time too, but few enough not to matter much
+    completed = requests - errors
+    return TargetResult(
+        requests=requests,
+        errors=errors,
+        duration_seconds=duration,
+        throughput_per_second=completed / duration if duration else 0.0,
+        latency_summary=summarize_latencies(timings),
+    )
+
+
+async def run_load_test(args: argparse.Namespace) -> LoadTestResult:
+    started = datetime.now(timezone.utc)
+    log_dir = Path(tempfile.mkdtemp(prefix="load_test_"))
+    llm_url = f"http://127.0.0.1:{args.llm_port}"
+    system_one_url = f"http://127.0.0.1:{args.port}"
+    system_two_url = f"http://127.0.0.1:{args.port + 1}"
+    env = {**os.environ, "OLLAMA_HOST": llm_url}
+
+    fake_llm_arguments = [
+        f"--{name.replace('_', '-')}={value}"
+        for name, value in fake_llm.configuration_from_arguments(args)
+        .model_dump(exclude_none=True)
+        .items()
+    ]
+    app_arguments = ["app.py", *args.app_arguments]
+    processes = [
+        (
+            llm_url,
+            _start(
+                ["-m", "benchmarks.fake_llm", *fake_llm_arguments],
+                args.llm_port,
+                log_dir,
+                "fake_llm",
+                env,
+            ),
+        ),
+        (
+            f"{system_two_url}/ready",
+            _start(
+                [*app_arguments, "--system-two"],
+                args.port + 1,
+                log_dir,
+                "system_two",
+                env,
+            ),
+        ),
+        (
+            f"{system_one_url}/ready",
+            _start(
+                [*app_arguments, "--system-two-url", system_two_url],
+                args.port,
+                log_dir,
+                "system_one",
+                env,
+            ),
+        ),
+    ]
+    logging.info(f"Server logs in {log_dir}")
+    try:
+        for url, process in processes:
+            await _wait_until_up(url, process)
+        targets = {}
+        for target in args.targets:
+            url = system_two_url if target == "system2" else system_one_url
+            async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+                targets[target] = await run_target(
+                    client, target, args.requests, args.concurrency, args.warmup
+                )
+    finally:
+        for _, process in processes:
+            process.terminate()
+        for _, process in processes:
+            process.wait()
+
+    parameters = {
+        name: value
+        for name, value in vars(args).items()
+        if name not in ("output", "baseline", "results", "tolerance", "min_delta_ms")
+    }
+    return LoadTestResult(
+        started=started.strftime("%Y-%m-%d_%H_%M_%S"),
+        parameters=parameters,
+        targets=targets,
+    )
+
+
+def compare(
+    baseline: LoadTestResult,
+    current: LoadTestResult,
+    tolerance: float,
+    min_delta_seconds: float,
+) -> list[Regression]:
+    """Stages whose p50/p95 grew, or targets whose throughput fell, by more than
+    `tolerance` (a fraction); latency changes under `min_delta_seconds` are noise."""
+    regressions = []
+    for target, current_result in current.targets.items():
+        baseline_result = baseline.targets.get(target)
+        if baseline_result is None:
+            continue
+        if (
+            current_result.throughput_per_second
+            < baseline_result.throughput_per_second * (1 - tolerance)
+        ):
+            regressions.append(
+                Regression(
+                    target=target,
+                    metric="throughput_per_second",
+                    baseline=baseline_result.throughput_per_second,
+                    current=current_result.throughput_per_second,
+                )
+            )
+        for stage, summary in current_result.latency_summary.items():
+            baseline_summary = baseline_result.latency_summary.get(stage)
+            if baseline_summary is None:
+                continue
+            for metric in ("p50_seconds", "p95_seconds"):
+                before = getattr(baseline_summary, metric)
+                after = getattr(summary, metric)
+                if (
+                    after > before * (1 + tolerance)
+                    and after - before > min_delta_seconds
+                ):
+                    regressions.append(
+                        Regression(
+                            target=target,
+                            metric=f"{stage} {metric}",
+                            baseline=before,
+                            current=after,
+                        )
+                    )
+    return regressions
+
+
+def print_report(result: LoadTestResult) -> None:
+    for target, target_result in result.targets.items():
+        print(
+            f"\n/{target}: {target_result.requests} requests, {target_result.errors} errors, "
+            f"{target_result.throughput_per_second:.2f} requests/s"
+        )
+        print(f"  {'stage':<40} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for stage, summary in target_result.latency_summary.items():
+            print(
+                f"  {stage:<40} {summary.count:>6} {summary.p50_seconds * 1000:>9.1f} "
+                f"{summary.p95_seconds * 1000:>9.1f} {summary.p99_seconds * 1000:>9.1f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test the app end to end against a fake model server"
+    )
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--requests", type=int, default=100, help="Per target")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=4,
+        help="Requests per target left out of the results",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8100,
+        help="System 1 listens here, System 2 on the next port",
+    )
+    parser.add_argument("--llm-port", type=int, default=11435)
+    parser.add_argument(
+        "--app-arguments",
+        nargs=argparse.REMAINDER,
+        default=[],
+        help="Passed on to both app.py instances, e.g. --configuration my.json (must come last)",
+    )
+    fake_llm.add_arguments(parser)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Where to write the results (default load_test_<timestamp>.json)",
+    )
+    parser.add_argument(
+        "--baseline", default=None, help="Earlier results to compare this run against"
+    )
+    parser.add_argument(
+        "--results",
+        default=None,
+        help="Compare these saved results against --baseline instead of running",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown before it counts as a regression, as a fraction",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=5.0,
+        help="Latency changes smaller than this are never regressions",
+    )
+    args = parser.parse_args()
+    if args.results and not args.baseline:
+        parser.error("--results requires --baseline")
+
+    if args.results:
+        result = LoadTestResult.model_validate_json(Path(args.results).read_text())
+    else:
+        result = asyncio.run(run_load_test(args))
+        output = (
+            args.output
+            or f"load_test_{datetime.now(timezone.utc).strftime('%Y-%m-%d_%H_%M')}.json"
+        )
+        Path(output).write_text(result.model_dump_json(indent=2))
+        logging.info(f"Results written to {output}")
+    print_report(result)
+
+    if args.baseline:
+        baseline = LoadTestResult.model_validate_json(Path(args.baseline).read_text())
+        if baseline.parameters != result.parameters:
+            logging.warning("Baseline was run with different parameters")
+        regressions = compare(
+            baseline, result, args.tolerance, args.min_delta_ms / 1000
+        )
+        for regression in regressions:
+            print(
+                f"REGRESSION /{regression.target} {regression.metric}: "
+                f"{regression.baseline:.4f} -> {regression.current:.4f}"
+            )
+        if regressions:
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Micro-benchmarks of the CPU-side work on the request path, runnable offline:
+
+python -m pytest benchmarks/test_micro_benchmarks.py
+python -m pytest benchmarks/test_micro_benchmarks.py --benchmark-autosave
+python -m pytest benchmarks/test_micro_benchmarks.py --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+
+import json
+from dataclasses import asdict
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from app_graph import create_system_two_node_graph
+from charts import clean_values, generate_bar_chart, generate_chart
+from metacognitive import (
+    MSV_DIMENSIONS,
+    ConflictInformation,
+    CorrectnessResponse,
+    EmotionalResponse,
+    ExperientialMatchingResponse,
+    MetacognitiveVector,
+    ProblemImportance,
+    _affect_frequencies,
+)
+from prompts import PromptNames, Prompts
+from system_two_model import (
+    DeliberationDecision,
+    DeliberationStep,
+    NodeResponse,
+    NodeRole,
+    SystemTwoResponse,
+)
+
+USER_PROMPT = "My code throws a KeyError only in production, where do I start?"
+# about the length of a System 1 reply
+RESPONSE = (
+    "A KeyError that only shows up in production usually means the data there differs "
+    "from what you test with. Start by logging the missing key and the keys that are "
+    "present when it happens, then compare configuration, environment variables and "
+    "input payloads between the two environments. Check for optional fields that your "
+    "fixtures always fill in, for code paths behind feature flags, and for caches that "
+    "are warm in production but empty locally. I'm fairly confident one of these is the "
+    "cause, although without the traceback I can't be certain which. "
+) * 3
+
+
+@pytest.fixture
+def msv() -> MetacognitiveVector:
+    return MetacognitiveVector(
+        emotional_response=EmotionalResponse(
+            fear=4.2,
+            anger=1.1,
+            anticipation=12.5,
+            trust=18.0,
+            surprise=3.3,
+            positive=25.0,
+            negative=9.1,
+            sadness=2.0,
+            disgust=0.5,
+            joy=6.7,
+        ),
+        correctness=CorrectnessResponse(
+            logical_consistency=85, factual_accuracy=78, contextual_appropriateness=90
+        ),
+        experiential_matching=ExperientialMatchingResponse(
+            knowledge_base_matching=62, historical_responses_matching=70
+        ),
+        conflict_information=ConflictInformation(
+            internal_consistency=88, source_agreement=55, temporal_stability=72
+        ),
+        problem_importance=ProblemImportance(
+            potential_consequences=60, temporal_urgency=75, scope_of_impact=40
+        ),
+    )
+
+
+@pytest.fixture
+def system_two_response(msv: MetacognitiveVector) -> SystemTwoResponse:
+    roles = (NodeRole.Critic, NodeRole.Domain_Expert, NodeRole.Evaluator)
+    return SystemTwoResponse(
+        system_two_response=RESPONSE,
+        metacognitive_vector=msv,
+        node_responses=[
+            NodeResponse(node_role=role, node_response=RESPONSE, node_msv=msv)
+            for role in roles
+        ],
+        deliberation=[
+            DeliberationStep(
+                round=1,
+                node_role=role,
+                decision=DeliberationDecision.Continue,
+                reason="correctness below the stop threshold",
+            )
+            for role in roles
+        ],
+    )
+
+
+def test_compute_value(benchmark, msv):
+    dimensions = [getattr(msv, dimension) for dimension in MSV_DIMENSIONS] + [msv]
+
+    def compute_all():
+        return [dimension._compute_value() for dimension in dimensions]
+
+    assert benchmark(compute_all)[-1] == msv.calculated_value
+
+
+def test_msv_serialization(benchmark, msv):
+    # what record_interaction stores per MSV
+    serialized = benchmark(lambda: json.dumps(asdict(msv)))
+    assert json.loads(serialized)["calculated_value"] == msv.calculated_value
+
+
+def test_chart_values(benchmark, msv):
+    # what get_chart extracts from each MSV for its charts
+    values = benchmark(
+        lambda: [clean_values(getattr(msv, dimension)) for dimension in MSV_DIMENSIONS]
+    )
+    assert "fear" in values[0]
+
+
+@pytest.mark.parametrize(
+    "prompt_name, context",
+    [
+        (
+            PromptNames.Correctness,
+            {"original_prompt": USER_PROMPT, "message": RESPONSE},
+        ),
+        (
+            PromptNames.Experiential_Matching,
+            {
+                "message": RESPONSE,
+                "knowledge_base": RESPONSE,
+                "historical_responses": RESPONSE,
+            },
+        ),
+        (PromptNames.Problem_Importance, {"original_prompt": USER_PROMPT}),
+    ],
+)
+def test_get_prompt(benchmark, prompt_name, context):
+    rendered = benchmark(Prompts().get_prompt, prompt_name, context)
+    assert all(value in rendered for value in context.values())
+
+
+def test_generate_chart(benchmark, msv):
+    data = clean_values(msv.emotional_response)
+    benchmark(generate_chart, data, "Emotion Components", "System 1 Emotion Vector")
+
+
+def test_generate_bar_chart(benchmark, msv):
+    data = clean_values(msv.emotional_response)
+    benchmark(generate_bar_chart, data, "Emotion Components", "System 1 Emotion Vector")
+
+
+def test_nrclex(benchmark):
+    # the uncached scoring, as for every new response
+    try:
+        _affect_frequencies.__wrapped__(USER_PROMPT)
+    except Exception as e:
+        pytest.skip(f"NRCLex can't score text here ({e!r}), see the install steps")
+    frequencies = dict(benchmark(_affect_frequencies.__wrapped__, RESPONSE))
+    assert "anticipation" in frequencies
+
+
+def test_create_system_two_node_graph(benchmark, system_two_response):
+    plot, nodes = benchmark(create_system_two_node_graph, system_two_response)
+    # the three nodes and the synthesis
+    assert len(nodes) == 4
@@ -0,0 +1,133 @@
+from collections import deque
+from dataclasses import dataclass
+from enum import StrEnum, auto
+
+from pydantic import BaseModel, Field
+
+import llm
+from accounting import timed
+from prompts import PromptNames, Prompts
+
+
+class ContextPolicy(StrEnum):
+    # drop the oldest messages
+    Truncate = auto()
+    # fold the oldest messages into a running summary
+    Summarize = auto()
+
+
+class ContextConfiguration(BaseModel):
+    # tokens of history (summary included) sent to System 1 with each prompt
+    budget_tokens: int = Field(default=2048, ge=1)
+    policy: ContextPolicy = ContextPolicy.Truncate
+    # tokens of earlier replies the judges get as historical responses
+    digest_tokens: int = Field(default=512, ge=1)
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly four characters per token, close enough for budgeting without a tokenizer."""
+    return len(text) // 4 + 1
+
+
+@dataclass
+class Message:
+    role: str
+    content: str
+    tokens: int
+
+
+class Conversation:
+    """A session's history, kept within a token budget so prompt size stays flat as the
+    conversation grows.
+
+    Token counts are taken once per message, when it's appended, and the historical
+    responses digest is updated as replies come in rather than rebuilt from the whole history.
+    """
+
+    def __init__(
+        self,
+        configuration: ContextConfiguration | None = None,
+        prompts: Prompts | None = None,
+    ):
+        self.configuration = configuration or ContextConfiguration()
+        self.prompts = prompts or Prompts()
+        self.messages: deque[Message] = deque()
+        self.tokens = 0
+        self.summary = ""
+        self._replies: deque[Message] = deque()
+        self._reply_tokens = 0
+        self._digest = ""
+
+    def context(self) -> list[dict]:
+        """The messages to send along with the next prompt."""
+        context = [
+            {"role": message.role, "content": message.content}
+            for message in self.messages
+        ]
+        if self.summary:
+            context.insert(
+                0,
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation: {self.summary}",
+                },
+            )
+        return context
+
+    @property
+    def historical_responses(self) -> str:
+        return self._digest
+
+    async def append(self, role: str, content: str) -> None:
+        message = Message(role=role, content=content, tokens=estimate_tokens(content))
+        self.messages.append(message)
+        self.tokens += message.tokens
+        if role == "assistant":
+            self._add_reply(message)
+
+        evicted = []
+        # always keep the latest message, even when it alone is over budget
+        while len(self.messages) > 1 and self.tokens > self._message_budget:
+            oldest = self.messages.popleft()
+            self.tokens -= oldest.tokens
+            evicted.append(oldest)
+        if evicted and self.configuration.policy == ContextPolicy.Summarize:
+            await self._summarize(evicted)
+
+    @property
+    def _summary_budget(self) -> int:
+        # the summary gets at most a quarter of the budget, the rest is for recent messages
+        if self.configuration.policy == ContextPolicy.Summarize:
+            return max(self.configuration.budget_tokens // 4, 1)
+        return 0
+
+    @property
+    def _message_budget(self) -> int:
+        return self.configuration.budget_tokens - self._summary_budget
+
+    def _add_reply(self, message: Message) -> None:
+        self._replies.append(message)
+        self._reply_tokens += message.tokens
+        while (
+            len(self._replies) > 1
+            and self._reply_tokens > self.configuration.digest_tokens
+        ):
+            self._reply_tokens -= self._replies.popleft().tokens
+        self._digest = "\n".join(reply.content for reply in self._replies)
+
+    async def _summarize(self, evicted: list[Message]) -> None:
+        content = self.prompts.get_prompt(
+            PromptNames.Conversation_Summary,
+            context={
+                "summary": self.summary,
+                "conversation": "\n".join(
+                    f"{message.role}: {message.content}" for message in evicted
+                ),
+            },
+        )
+        with timed("context_summary"):
+            response = await llm.chat(
+                [{"role": "user", "content": content}],
+                options={"num_predict": self._summary_budget},
+            )
+        self.summary = response.message.content
@@ -0,0 +1,231 @@
+import argparse
+import json
+import math
+import sqlite3
+import sys
+from collections.abc import Callable
+from enum import StrEnum, auto
+
+import numpy as np
+from pydantic import BaseModel, Field, field_validator
+
+from metacognitive import MSV_DIMENSIONS, MetacognitiveVector
+
+
+class Activation(StrEnum):
+    Sigmoid = auto()
+    Linear = auto()
+    Step = auto()
+
+
+class DimensionTrigger(BaseModel):
+    """Escalate when a dimension's value (0-100) is above or below these, whatever the
+    overall activation."""
+
+    above: float | None = None
+    below: float | None = None
+
+    def fires(self, value: float) -> bool:
+        return (self.above is not None and value > self.above) or (
+            self.below is not None and value < self.below
+        )
+
+
+class EscalationConfiguration(BaseModel):
+    """When System 1 hands a turn to System 2.
+
+    The MSV's overall value goes through the activation function, centred on `midpoint`
+    and stretched by `scale`; System 2 engages when the result reaches `threshold`, or any
+    dimension trigger fires. The defaults reproduce the original sigmoid, which engages on
+    practically every turn; fit real ones to recorded sessions with
+    `python escalation.py --sessions data/*.sqlite3 --target_rate 0.3`.
+    """
+
+    activation: Activation = Activation.Sigmoid
+    midpoint: float = 0.0
+    scale: float = Field(default=100000.0, gt=0)
+    # None uses the session's msv_weights.activation_threshold
+    threshold: float | None = None
+    dimension_triggers: dict[str, DimensionTrigger] = Field(default_factory=dict)
+
+    @field_validator("dimension_triggers")
+    @classmethod
+    def _known_dimensions(
+        cls, dimension_triggers: dict[str, DimensionTrigger]
+    ) -> dict[str, DimensionTrigger]:
+        unknown = set(dimension_triggers) - set(MSV_DIMENSIONS)
+        if unknown:
+            raise ValueError(
+                f"Unknown MSV dimensions {sorted(unknown)}, expected some of {list(MSV_DIMENSIONS)}"
+            )
+        return dimension_triggers
+
+
+def _sigmoid(value: float, configuration: EscalationConfiguration) -> float:
+    exponent = -(value - configuration.midpoint) / configuration.scale
+    # math.exp overflows far below the midpoint, where the sigmoid is 0 anyway
+    return 1 / (1 + math.exp(exponent)) if exponent < 700 else 0.0
+
+
+def _linear(value: float, configuration: EscalationConfiguration) -> float:
+    return min(
+        max(0.5 + (value - configuration.midpoint) / configuration.scale, 0.0), 1.0
+    )
+
+
+def _step(value: float, configuration: EscalationConfiguration) -> float:
+    return 1.0 if value >= configuration.midpoint else 0.0
+
+
+# Add an `Activation` member and its function here to plug in another shape
+ACTIVATIONS: dict[Activation, Callable[[float, EscalationConfiguration], float]] = {
+    Activation.Sigmoid: _sigmoid,
+    Activation.Linear: _linear,
+    Activation.Step: _step,
+}
+
+
+def activation(value: float, configuration: EscalationConfiguration) -> float:
+    return ACTIVATIONS[configuration.activation](value, configuration)
+
+
+def should_escalate(
+    vector: MetacognitiveVector, configuration: EscalationConfiguration
+) -> bool:
+    threshold = (
+        configuration.threshold
+        if configuration.threshold is not None
+        else vector.activation_threshold
+    )
+    if activation(vector.calculated_value, configuration) >= threshold:
+        return True
+    return any(
+        trigger.fires(getattr(vector, dimension).calculated_value)
+        for dimension, trigger in configuration.dimension_triggers.items()
+    )
+
+
+def load_recorded_values(session_files: list[str]) -> dict[str, np.ndarray]:
+    """System 1 MSV values ("overall" and each dimension) of every recorded interaction."""
+    values: dict[str, list[float]] = {
+        dimension: [] for dimension in ("overall",) + MSV_DIMENSIONS
+    }
+    for session_file in session_files:
+        connection = sqlite3.connect(session_file)
+        try:
+            rows = connection.execute(
+                "SELECT system_one_msv FROM interactions"
+            ).fetchall()
+        finally:
+            connection.close()
+        for (msv_json,) in rows:
+            msv = json.loads(msv_json)
+            values["overall"].append(msv["calculated_value"])
+            for dimension in MSV_DIMENSIONS:
+                values[dimension].append(msv[dimension]["calculated_value"])
+    return {
+        dimension: np.array(found, dtype=float) for dimension, found in values.items()
+    }
+
+
+def calibrate(
+    values: dict[str, np.ndarray],
+    target_rate: float,
+    activation_function: Activation = Activation.Sigmoid,
+    dimension_rates: dict[str, float] | None = None,
+) -> EscalationConfiguration:
+    """Fit the policy so about `target_rate` of the recorded turns escalate on the overall
+    value, plus per-dimension triggers that each fire on about their own rate."""
+    overall = values["overall"]
+    # escalate exactly on the turns above this quantile: activation 0.5 at the midpoint
+    midpoint = float(np.quantile(overall, 1 - target_rate))
+    # spread the activation over the middle of the recorded range
+    spread = float(np.subtract(*np.quantile(overall, [0.75, 0.25])))
+    scale = max(
+        spread / 4 if activation_function == Activation.Sigmoid else spread, 1.0
+    )
+    triggers = {
+        dimension: DimensionTrigger(
+            above=float(np.quantile(values[dimension], 1 - rate))
+        )
+        for dimension, rate in (dimension_rates or {}).items()
+    }
+    return EscalationConfiguration(
+        activation=activation_function,
+        midpoint=midpoint,
+        scale=scale,
+        threshold=0.5,
+        dimension_triggers=triggers,
+    )
+
+
+def escalation_rate(
+    values: dict[str, np.ndarray],
+    configuration: EscalationConfiguration,
+    activation_threshold: float = MetacognitiveVector.activation_threshold,
+) -> float:
+    """The share of the recorded turns `should_escalate` would escalate;
+    `activation_threshold` stands in for the sessions' msv_weights one, as there."""
+    threshold = (
+        configuration.threshold
+        if configuration.threshold is not None
+        else activation_threshold
+    )
+    escalated = np.array(
+        [activation(value, configuration) >= threshold for value in values["overall"]]
+    )
+    for dimension, trigger in configuration.dimension_triggers.items():
+        escalated |= np.array([trigger.fires(value) for value in values[dimension]])
+    return float(escalated.mean()) if escalated.size else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit the escalation policy to recorded sessions"
+    )
+    parser.add_argument(
+        "--sessions",
+        nargs="+",
+        required=True,
+        help="Session databases (data/*.sqlite3)",
+    )
+    parser.add_argument(
+        "--target_rate",
+        type=float,
+        required=True,
+        help="Share of turns that should escalate to System 2 on the overall MSV, e.g. 0.3",
+    )
+    parser.add_argument(
+        "--activation", choices=list(Activation), default=Activation.Sigmoid
+    )
+    parser.add_argument(
+        "--dimension_rate",
+        nargs="*",
+        default=[],
+        metavar="DIMENSION=RATE",
+        help="Also escalate on the top RATE of turns for a single dimension, e.g. problem_importance=0.1",
+    )
+    args = parser.parse_args()
+
+    dimension_rates = {}
+    for dimension_rate in args.dimension_rate:
+        dimension, _, rate = dimension_rate.partition("=")
+        if dimension not in MSV_DIMENSIONS:
+            parser.error(f"Unknown dimension {dimension}")
+        dimension_rates[dimension] = float(rate)
+
+    values = load_recorded_values(args.sessions)
+    if not values["overall"].size:
+        parser.error("No recorded interactions in these sessions")
+    configuration = calibrate(
+        values, args.target_rate, Activation(args.activation), dimension_rates
+    )
+    print(
+        f"Fitted to {values['overall'].size} turns, escalation rate on them: {escalation_rate(values, configuration):.2f}",
+        file=sys.stderr,
+    )
+    print(json.dumps({"escalation": configuration.model_dump(mode="json")}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,284 @@
 import argparse
-from datetime import datetime, timezone
+import asyncio
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta, timezone
+import json
 import logging
+import os
+from pathlib import Path
+from itertools import islice
+import re
+import time
 
-import requests
+import httpx
 
 
-from experiment_model import (CompletedExperiment, 
-                              CompletedExperiments, 
-                              Experiments, Experiment, 
-                              SystemOnePrompt, 
+from accounting import summarize_latencies
+from experiment_model import (CompletedExperiment,
+                              Experiment,
+                              Experiments,
+                              NewSession,
+                              PromptMetrics,
+                              PromptResult,
+                              StageTiming,
+                              SystemOnePrompt,
                               SystemOneResponse)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
-def run_experiments(url: str, experiments: Experiments):
-    logging.info("Starting experiments run")
-    completed = CompletedExperiments()
-    utc_run_start = datetime.now(timezone.utc)
-    
-    for experiment in experiments.experiments:
-        experiment_id = experiment.id
-        utc_experiment_start = datetime.now(timezone.utc)
-        
-        experiment_session_id: str | None = None
-        errors = []
-        logging.info(f"Starting experiment {experiment_id}")
-        number_of_prompts = len(experiment.prompts)
-        
+class RateLimiter:
+    """Spaces requests out so the whole run (all workers together) stays under a request rate."""
+
+    def __init__(self, requests_per_second: float | None):
+        self.interval = 1 / requests_per_second if requests_per_second else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def iter_experiments(experiment_file: str, chunk_size: int = 1 << 16) -> Iterator[Experiment]:
+    """Yield experiments one at a time, without parsing the whole file up front.
+
+    `.jsonl` files hold one experiment per line; anything else is read as an `Experiments`
+    document, decoding its `experiments` array one element at a time.
+    """
+    with open(experiment_file, "r") as file:
+        if experiment_file.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield Experiment.model_validate_json(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ""
+        position = None
+        while position is None:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"No experiments array found in {experiment_file}")
+            buffer += chunk
+            match = re.search(r'"experiments"\s*:\s*\[', buffer)
+            if match:
+                position = match.end()
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer):
+                if buffer[position] == "]":
+                    return
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    pass
+                else:
+                    yield Experiment.model_validate(item)
+                    continue
+            # the next element straddles the chunk boundary, drop what's parsed and read more
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"Truncated experiments array in {experiment_file}")
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def load_completed_ids(results_file: str) -> set[str]:
+    """Experiment ids already in a results file, dropping a partial last line left by a crash."""
+    path = Path(results_file)
+    if not path.exists():
+        return set()
+    content = path.read_text()
+    if content and not content.endswith("\n"):
+        content = content[: content.rfind("\n") + 1]
+        path.write_text(content)
+    completed_ids = {
+        CompletedExperiment.model_validate_json(line).experiment_id
+        for line in content.splitlines()
+        if line.strip()
+    }
+    logging.info(f"Resuming {results_file}, {len(completed_ids)} experiments already completed")
+    return completed_ids
+
+
+def append_result(results_file: str, completed_experiment: CompletedExperiment) -> None:
+    with open(results_file, "a") as file:
+        file.write(completed_experiment.model_dump_json() + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+async def run_experiment(client: httpx.AsyncClient, experiment: Experiment, rate_limiter: RateLimiter) -> CompletedExperiment:
+    experiment_id = experiment.id
+    utc_experiment_start = datetime.now(timezone.utc)
+
+    experiment_session_id: str | None = None
+    errors = []
+    prompt_metrics: list[PromptMetrics] = []
+    logging.info(f"Starting experiment {experiment_id}")
+    number_of_prompts = len(experiment.prompts)
+
+    try:
+        # Each experiment gets its own server-side session, so experiments can run side by side
+        response = await client.post("/sessions")
+        response.raise_for_status()
+        experiment_session_id = NewSession.model_validate(response.json()).session_id
+    except Exception as e:
+        errors.append(f"session - '{e}'")
+
+    if experiment_session_id:
         for prompt_index, prompt in enumerate(experiment.prompts):
-            logging.info(f"Sending prompt {prompt_index+1} of {number_of_prompts}")
+            logging.info(f"Experiment {experiment_id}: sending prompt {prompt_index+1} of {number_of_prompts}")
+            await rate_limiter.wait()
+            response = None
             try:
-                response = requests.post(f"{url}/system1", json=SystemOnePrompt(user_input=prompt).model_dump())
+                prompt_start = time.perf_counter()
+                response = await client.post("/system1", json=SystemOnePrompt(user_input=prompt, session_id=experiment_session_id).model_dump())
+                round_trip_seconds = time.perf_counter() - prompt_start
                 decoded_response = SystemOneResponse.model_validate(response.json())
-                experiment_session_id = decoded_response.session_id
+                # a turn that wasn't kept in a session doesn't end the experiment's session
+                experiment_session_id = decoded_response.session_id or experiment_session_id
+                prompt_metrics.append(PromptMetrics(prompt_index=prompt_index, round_trip_seconds=round_trip_seconds, timings=decoded_response.timings))
             except Exception as e:
                 response_code = response.status_code if response else -1
                 errors.append(f"{prompt_index} - '{response_code}' - '{e}'")
-        
-        utc_experiment_end = datetime.now(timezone.utc)
-        duration = (utc_experiment_end - utc_experiment_start).seconds
-        completed.completed_experiments.append(CompletedExperiment(experiment_id=experiment_id, 
-                                                         session_id=experiment_session_id, 
-                                                         errors=errors,
-                                                         experiment_start=utc_experiment_start.strftime("%Y-%m-%d_%H_%M_%S"),
-                                                         duration_seconds=duration))
-        logging.info(f"Experiment completed: {experiment_id}")
-        requests.post(f"{url}/reset")
-    
-    formatted_datetime = utc_run_start.strftime("%Y-%m-%d_%H_%M")
-    completed_experiments_file_name = f"completed_experiments_{formatted_datetime}.json"
-    logging.info(f"Run completed saving results to {completed_experiments_file_name}")
-    with open(completed_experiments_file_name, "w") as completed_file:
-        completed_file.write(completed.model_dump_json(indent=4))
+        try:
+            await client.delete(f"/sessions/{experiment_session_id}")
+        except Exception as e:
+            logging.warning(f"Unable to close session {experiment_session_id}: {e}")
+
+    logging.info(f"Experiment completed: {experiment_id}")
+    return completed_experiment(experiment_id, experiment_session_id, errors, utc_experiment_start, prompt_metrics)
+
+
+def completed_experiment(experiment_id: str, experiment_session_id: str | None, errors: list[str], utc_experiment_start: datetime, prompt_metrics: list[PromptMetrics]) -> CompletedExperiment:
+    utc_experiment_end = datetime.now(timezone.utc)
+    duration = (utc_experiment_end - utc_experiment_start).total_seconds()
+    all_timings = [timing for metrics in prompt_metrics for timing in metrics.timings]
+    round_trips = [StageTiming(stage="round_trip", duration_seconds=metrics.round_trip_seconds) for metrics in prompt_metrics]
+    return CompletedExperiment(experiment_id=experiment_id,
+                               session_id=experiment_session_id,
+                               errors=errors,
+                               experiment_start=utc_experiment_start.strftime("%Y-%m-%d_%H_%M_%S"),
+                               duration_seconds=duration,
+                               prompt_metrics=prompt_metrics,
+                               latency_summary=summarize_latencies(all_timings + round_trips),
+                               prompt_tokens=sum(timing.prompt_tokens for timing in all_timings),
+                               completion_tokens=sum(timing.completion_tokens for timing in all_timings))
+
+
+async def run_experiments(url: str, experiments: Iterable[Experiment], results_file: str, concurrency: int = 1, requests_per_second: float | None = None, resume: bool = False):
+    logging.info(f"Starting experiments run with concurrency {concurrency}, results in {results_file}")
+    already_completed = load_completed_ids(results_file) if resume else set()
+    finished = 0
+    run_start = time.monotonic()
+
+    rate_limiter = RateLimiter(requests_per_second)
+    # Workers share one iterator, so experiments are only read from disk as a worker frees up
+    experiment_iterator = iter(experiments)
+
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        async def worker() -> None:
+            nonlocal finished
+            for experiment in experiment_iterator:
+                if experiment.id in already_completed:
+                    continue
+                result = await run_experiment(client, experiment, rate_limiter)
+                append_result(results_file, result)
+                finished += 1
+                elapsed = time.monotonic() - run_start
+                logging.info(f"Progress: {finished} experiments completed ({elapsed:.0f}s elapsed, {finished / elapsed * 60:.1f} experiments/minute)")
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    logging.info(f"Run completed, {finished} experiments saved to {results_file}")
+
+
+async def run_experiments_in_batches(url: str, experiments: Iterable[Experiment], results_file: str, batch_size: int, resume: bool = False):
+    """Hand experiments to the server's /experiments endpoint, `batch_size` at a time.
+
+    The server runs them in-process (with its own concurrency limit) and streams back one
+    result per prompt, so there is no per-prompt HTTP round trip.
+    """
+    logging.info(f"Starting server-side experiments run in batches of {batch_size}, results in {results_file}")
+    already_completed = load_completed_ids(results_file) if resume else set()
+    pending = (experiment for experiment in experiments if experiment.id not in already_completed)
+    finished = 0
+    run_start = time.monotonic()
+
+    async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+        while batch := list(islice(pending, batch_size)):
+            utc_batch_start = datetime.now(timezone.utc)
+            unfinished = {experiment.id for experiment in batch}
+            session_ids: dict[str, str | None] = {}
+            # the server queues experiments for its slots, so each starts with its first prompt
+            experiment_starts: dict[str, datetime] = {}
+            errors: defaultdict[str, list[str]] = defaultdict(list)
+            prompt_metrics: defaultdict[str, list[PromptMetrics]] = defaultdict(list)
+
+            def finish(experiment_id: str) -> None:
+                nonlocal finished
+                append_result(results_file, completed_experiment(experiment_id, session_ids.get(experiment_id), errors[experiment_id], experiment_starts.get(experiment_id, utc_batch_start), prompt_metrics[experiment_id]))
+                unfinished.discard(experiment_id)
+                finished += 1
+                elapsed = time.monotonic() - run_start
+                logging.info(f"Progress: {finished} experiments completed ({elapsed:.0f}s elapsed, {finished / elapsed * 60:.1f} experiments/minute)")
+
+            try:
+                async with client.stream("POST", "/experiments", json=Experiments(experiments=batch).model_dump()) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        result = PromptResult.model_validate_json(line)
+                        session_ids[result.experiment_id] = result.session_id
+                        if result.prompt_index == 0:
+                            experiment_starts[result.experiment_id] = datetime.now(timezone.utc) - timedelta(seconds=result.duration_seconds)
+                        if result.error:
+                            errors[result.experiment_id].append(f"{result.prompt_index} - '{result.error}'")
+                        else:
+                            prompt_metrics[result.experiment_id].append(PromptMetrics(prompt_index=result.prompt_index, round_trip_seconds=result.duration_seconds, timings=result.timings))
+                        if result.prompt_index == result.prompt_count - 1:
+                            finish(result.experiment_id)
+            except Exception as e:
+                for experiment_id in unfinished:
+                    errors[experiment_id].append(f"batch - '{e}'")
+            # experiments without prompts, or cut short by an error
+            for experiment_id in list(unfinished):
+                finish(experiment_id)
+
+    logging.info(f"Run completed, {finished} experiments saved to {results_file}")
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--url", type=str, help="")
     parser.add_argument("--experiment_file", type=str, help="Path to the JSON file containing experiments.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of experiments to run in parallel.")
+    parser.add_argument("--requests_per_second", type=float, default=None, help="Upper bound on /system1 requests per second across all experiments.")
+    parser.add_argument("--results_file", type=str, default=None, help="JSONL file each completed experiment is appended to (default completed_experiments_<timestamp>.jsonl).")
+    parser.add_argument("--resume", default=False, action="store_true", help="Skip experiments already completed in --results_file and append to it.")
+    parser.add_argument("--batch_size", type=int, default=None, help="Run experiments server-side through /experiments, this many per request (the server's --experiment-concurrency applies instead of --concurrency).")
 
     args = parser.parse_args()
+    if args.resume and not args.results_file:
+        parser.error("--resume requires --results_file")
 
-    with open(args.experiment_file, "r") as file:
-        experiments = Experiments.model_validate_json(file.read())
-    
-    run_experiments(args.url, experiments)
+    results_file = args.results_file or f"completed_experiments_{datetime.now(timezone.utc).strftime('%Y-%m-%d_%H_%M')}.jsonl"
+    if args.batch_size:
+        asyncio.run(run_experiments_in_batches(args.url, iter_experiments(args.experiment_file), results_file, args.batch_size, args.resume))
+    else:
+        asyncio.run(run_experiments(args.url, iter_experiments(args.experiment_file), results_file, args.concurrency, args.requests_per_second, args.resume))
 
 
 if __name__ == '__main__':
@@ -8,12 +8,54 @@ class Experiments(BaseModel):
     experiments: list[Experiment]
 
 
+class StageTiming(BaseModel):
+    """Wall time (and model tokens) of one pipeline stage, e.g. `system_one` or `judge:correctness`"""
+    stage: str
+    duration_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class LatencySummary(BaseModel):
+    count: int
+    total_seconds: float
+    p50_seconds: float
+    p95_seconds: float
+    p99_seconds: float
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class PromptMetrics(BaseModel):
+    prompt_index: int
+    # as seen by the harness, including HTTP overhead
+    round_trip_seconds: float
+    timings: list[StageTiming] = Field(default=[])
+
+
+class PromptResult(BaseModel):
+    """One line of the /experiments NDJSON stream"""
+    experiment_id: str
+    session_id: str | None
+    prompt_index: int
+    prompt_count: int
+    response: str | None
+    error: str | None
+    duration_seconds: float
+    timings: list[StageTiming] = Field(default=[])
+
+
 class CompletedExperiment(BaseModel):
     experiment_id: str
-    session_id: str
+    session_id: str | None
     errors: list[str]
     experiment_start: str
-    duration_seconds: int
+    duration_seconds: float
+    prompt_metrics: list[PromptMetrics] = Field(default=[])
+    # per stage, plus "round_trip" for the whole /system1 request
+    latency_summary: dict[str, LatencySummary] = Field(default={})
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
 
 
 class CompletedExperiments(BaseModel):
@@ -22,7 +64,15 @@ class CompletedExperiments(BaseModel):
 
 class SystemOnePrompt(BaseModel):
     user_input: str
+    # None targets the web UI's session
+    session_id: str | None = None
 
 class SystemOneResponse(BaseModel):
     response: str
+    # None when the turn wasn't kept in a session
+    session_id: str | None
+    timings: list[StageTiming] = Field(default=[])
+
+
+class NewSession(BaseModel):
     session_id: str
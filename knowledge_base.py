@@ -0,0 +1,167 @@
+import argparse
+import json
+import logging
+import re
+from collections import Counter
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+DOCUMENT_SUFFIXES = (".txt", ".md")
+MATRIX_FILE = "tfidf.npz"
+CHUNKS_FILE = "chunks.json"
+
+
+@dataclass
+class Chunk:
+    source: str
+    text: str
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def chunk_text(text: str, chunk_words: int = 200, overlap_words: int = 40) -> list[str]:
+    """Split `text` into windows of `chunk_words` words, each overlapping the previous one,
+    so a passage cut at a boundary is still whole in one of them."""
+    words = text.split()
+    step = max(chunk_words - overlap_words, 1)
+    return [
+        " ".join(words[start : start + chunk_words])
+        for start in range(0, max(len(words) - overlap_words, 1), step)
+        if words[start : start + chunk_words]
+    ]
+
+
+class KnowledgeBase:
+    """Document chunks with a TF-IDF index, to retrieve the few relevant to a prompt.
+
+    Built once from a directory of text/markdown files and saved next to its chunks, so the
+    app only loads the index at startup.
+    """
+
+    def __init__(
+        self,
+        chunks: list[Chunk],
+        vocabulary: dict[str, int],
+        idf: np.ndarray,
+        matrix: sparse.csr_matrix,
+    ):
+        self.chunks = chunks
+        self.vocabulary = vocabulary
+        self.idf = idf
+        # chunks × terms, rows L2-normalized so a dot product is the cosine similarity
+        self.matrix = matrix
+
+    @classmethod
+    def build(
+        cls, document_dir: str, chunk_words: int = 200, overlap_words: int = 40
+    ) -> "KnowledgeBase":
+        chunks = [
+            Chunk(source=str(path.relative_to(document_dir)), text=text)
+            for path in sorted(Path(document_dir).rglob("*"))
+            if path.suffix in DOCUMENT_SUFFIXES
+            for text in chunk_text(path.read_text(), chunk_words, overlap_words)
+        ]
+        term_counts = [Counter(tokenize(chunk.text)) for chunk in chunks]
+        vocabulary: dict[str, int] = {}
+        for counts in term_counts:
+            for term in counts:
+                vocabulary.setdefault(term, len(vocabulary))
+
+        rows, columns, values = [], [], []
+        for row, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                rows.append(row)
+                columns.append(vocabulary[term])
+                values.append(count)
+        term_matrix = sparse.csr_matrix(
+            (values, (rows, columns)), shape=(len(chunks), len(vocabulary)), dtype=float
+        )
+        document_frequency = np.bincount(term_matrix.indices, minlength=len(vocabulary))
+        # smoothed, so terms in every chunk still count for a little
+        idf = np.log((1 + len(chunks)) / (1 + document_frequency)) + 1
+        matrix = _normalize_rows(term_matrix.multiply(idf).tocsr())
+        logging.info(
+            f"Indexed {len(chunks)} chunks, {len(vocabulary)} terms from {document_dir}"
+        )
+        return cls(chunks, vocabulary, idf, matrix)
+
+    def save(self, index_dir: str) -> None:
+        path = Path(index_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        sparse.save_npz(path / MATRIX_FILE, self.matrix)
+        (path / CHUNKS_FILE).write_text(
+            json.dumps(
+                {
+                    "chunks": [asdict(chunk) for chunk in self.chunks],
+                    "vocabulary": self.vocabulary,
+                    "idf": self.idf.tolist(),
+                }
+            )
+        )
+
+    @classmethod
+    def load(cls, index_dir: str) -> "KnowledgeBase":
+        path = Path(index_dir)
+        saved = json.loads((path / CHUNKS_FILE).read_text())
+        return cls(
+            [Chunk(**chunk) for chunk in saved["chunks"]],
+            saved["vocabulary"],
+            np.array(saved["idf"]),
+            sparse.load_npz(path / MATRIX_FILE).tocsr(),
+        )
+
+    def search(self, query: str, top_k: int = 3) -> list[Chunk]:
+        """The `top_k` chunks most similar to `query`, best first; none share a term -> []"""
+        counts = Counter(term for term in tokenize(query) if term in self.vocabulary)
+        if not counts or not self.chunks:
+            return []
+        query_vector = np.zeros(len(self.vocabulary))
+        for term, count in counts.items():
+            query_vector[self.vocabulary[term]] = count
+        query_vector *= self.idf
+        scores = self.matrix @ (query_vector / np.linalg.norm(query_vector))
+        top_k = min(top_k, len(self.chunks))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return [
+            self.chunks[index]
+            for index in best[np.argsort(-scores[best])]
+            if scores[index] > 0
+        ]
+
+
+def _normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Build the knowledge base index the app retrieves from"
+    )
+    parser.add_argument(
+        "--documents", required=True, help="Directory of .txt/.md documents"
+    )
+    parser.add_argument(
+        "--index", default="data/knowledge_base", help="Directory to write the index to"
+    )
+    parser.add_argument("--chunk_words", type=int, default=200)
+    parser.add_argument("--overlap_words", type=int, default=40)
+    args = parser.parse_args()
+
+    KnowledgeBase.build(args.documents, args.chunk_words, args.overlap_words).save(
+        args.index
+    )
+    logging.info(f"Knowledge base index written to {args.index}")
+
+
+if __name__ == "__main__":
+    main()
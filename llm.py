@@ -0,0 +1,257 @@
+import hashlib
+import json
+import sqlite3
+import zlib
+from enum import StrEnum, auto
+from typing import Any
+
+import ollama
+from pydantic import BaseModel
+
+import accounting
+import metrics
+import scheduler
+from batching import MicroBatcher
+from singleflight import SingleFlight
+
+DEFAULT_MODEL = "llama3.2"
+
+# One shared async client, so concurrent sessions don't block the event loop on model calls
+client = ollama.AsyncClient()
+
+
+def request_key(call: str, model: str, request: dict[str, Any]) -> str:
+    """Hash of the request with what doesn't change the answer taken out: key order,
+    whitespace around message content and unset options."""
+    normalized = {"call": call, "model": model}
+    for name, value in request.items():
+        if value is None:
+            continue
+        if name == "messages":
+            value = [
+                {
+                    field: item.strip() if isinstance(item, str) else item
+                    for field, item in message.items()
+                }
+                for message in value
+            ]
+        elif isinstance(value, dict):
+            value = {key: item for key, item in value.items() if item is not None}
+        normalized[name] = value
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class CassetteMode(StrEnum):
+    # call the model and keep every request and response
+    Record = auto()
+    # answer from the recorded responses only, never calling the model
+    Replay = auto()
+
+
+class CassetteMiss(KeyError):
+    """Replaying, and this request was never recorded."""
+
+
+class Cassette:
+    """Model calls and their responses, in a sqlite file keyed by the normalized request.
+
+    Recording a run and replaying it reproduces its responses, and so its MSVs, without a
+    model and in a fraction of the time.
+    """
+
+    def __init__(self, path: str, mode: CassetteMode):
+        self.mode = mode
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS calls (
+                key TEXT PRIMARY KEY,
+                call TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response BLOB NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+    def get(self, key: str, response_type: type[BaseModel]) -> BaseModel:
+        row = self.connection.execute(
+            "SELECT response FROM calls WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            metrics.cache_lookups.inc(cache="cassette", result="miss")
+            raise CassetteMiss(key)
+        metrics.cache_lookups.inc(cache="cassette", result="hit")
+        return response_type.model_validate_json(zlib.decompress(row[0]))
+
+    def put(self, key: str, call: str, model: str, response: BaseModel) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO calls (key, call, model, response) VALUES (?, ?, ?, ?)",
+            (
+                key,
+                call,
+                model,
+                zlib.compress(response.model_dump_json(exclude_none=True).encode()),
+            ),
+        )
+        self.connection.commit()
+
+
+# Set by `use_cassette`, None calls the model as usual
+cassette: Cassette | None = None
+
+
+def use_cassette(path: str | None, mode: CassetteMode = CassetteMode.Record) -> None:
+    global cassette
+    cassette = Cassette(path, mode) if path else None
+
+
+# Set by `use_keep_alive`: how long the model server keeps a model loaded after a call,
+# None leaves it to the server's default
+keep_alive: str | float | None = None
+
+
+def use_keep_alive(duration: str | None) -> None:
+    """`duration` as ollama takes it, e.g. "30m", or seconds, negative for ever."""
+    global keep_alive
+    try:
+        keep_alive = float(duration)
+    except (TypeError, ValueError):
+        keep_alive = duration
+
+
+def _keep_alive() -> dict[str, str | float]:
+    # every call sets the expiry anew, so it's sent with each one, not just the warm-up
+    return {} if keep_alive is None else {"keep_alive": keep_alive}
+
+
+async def _client_chat(model: str, **request) -> ollama.ChatResponse:
+    async with scheduler.scheduler.slot(model):
+        return await client.chat(model=model, **request, **_keep_alive())
+
+
+async def _client_embed(model: str, texts: list[str]) -> ollama.EmbedResponse:
+    async with scheduler.scheduler.slot(model):
+        return await client.embed(model=model, input=texts, **_keep_alive())
+
+
+async def warm_up(model: str, embedding: bool = False) -> None:
+    """Load `model` into the model server's memory, generating nothing."""
+    if embedding:
+        await client.embed(model=model, input="warm up", **_keep_alive())
+    else:
+        # ollama loads the model for a chat without messages, and returns right away
+        await client.chat(model=model, messages=[], **_keep_alive())
+
+
+def tagged(model: str) -> str:
+    """`model` as the model server lists it, e.g. llama3.2:latest for llama3.2."""
+    return model if ":" in model else f"{model}:latest"
+
+
+async def resident_models() -> set[str]:
+    return {model.model for model in (await client.ps()).models}
+
+
+# Set by `use_batching`, None sends every call on its own
+batcher: MicroBatcher | None = None
+
+
+def use_batching(window: float) -> None:
+    global batcher
+    batcher = MicroBatcher(_client_embed, window) if window > 0 else None
+
+
+async def _send_embed(
+    model: str, texts: list[str], batched: bool
+) -> ollama.EmbedResponse:
+    if batched and batcher is not None:
+        return await batcher.embed(model, texts)
+    return await _client_embed(model, texts)
+
+
+async def _chat(model: str, **request) -> ollama.ChatResponse:
+    if cassette is None:
+        return await _client_chat(model, **request)
+    key = request_key("chat", model, request)
+    if cassette.mode == CassetteMode.Replay:
+        return cassette.get(key, ollama.ChatResponse)
+    response = await _client_chat(model, **request)
+    cassette.put(key, "chat", model, response)
+    return response
+
+
+async def _embed(model: str, texts: list[str], batched: bool) -> ollama.EmbedResponse:
+    if cassette is None:
+        return await _send_embed(model, texts, batched)
+    # one entry per text, which texts are batched together depends on the embedding cache
+    keys = [request_key("embed", model, {"input": text}) for text in texts]
+    if cassette.mode == CassetteMode.Replay:
+        responses = [cassette.get(key, ollama.EmbedResponse) for key in keys]
+        return ollama.EmbedResponse(
+            model=model,
+            embeddings=[response.embeddings[0] for response in responses],
+            prompt_eval_count=sum(
+                response.prompt_eval_count or 0 for response in responses
+            ),
+        )
+    response = await _send_embed(model, texts, batched)
+    # each text keeps its share of the tokens, so replays account the same tokens
+    shares = accounting.token_shares(response.prompt_eval_count, texts)
+    for key, embedding, tokens in zip(keys, response.embeddings, shares):
+        cassette.put(
+            key,
+            "embed",
+            model,
+            ollama.EmbedResponse(
+                model=model, embeddings=[embedding], prompt_eval_count=tokens
+            ),
+        )
+    return response
+
+
+# Identical calls in flight at the same time are made once, the others wait for its response
+_chats: SingleFlight[ollama.ChatResponse] = SingleFlight("chat")
+_embeddings: SingleFlight[ollama.EmbedResponse] = SingleFlight("embed")
+
+
+async def _counted_chat(model: str, **request) -> ollama.ChatResponse:
+    response = await _chat(model, **request)
+    accounting.add_tokens(response.prompt_eval_count, response.eval_count)
+    metrics.llm_calls.inc(model=model, call="chat")
+    metrics.llm_tokens.inc(response.prompt_eval_count or 0, model=model, kind="prompt")
+    metrics.llm_tokens.inc(response.eval_count or 0, model=model, kind="completion")
+    return response
+
+
+async def _counted_embed(
+    model: str, texts: list[str], batched: bool
+) -> ollama.EmbedResponse:
+    response = await _embed(model, texts, batched)
+    accounting.add_tokens(response.prompt_eval_count, 0)
+    metrics.llm_calls.inc(model=model, call="embed")
+    metrics.llm_tokens.inc(response.prompt_eval_count or 0, model=model, kind="prompt")
+    return response
+
+
+async def chat(
+    messages: list[dict], model: str = DEFAULT_MODEL, **kwargs
+) -> ollama.ChatResponse:
+    request = {"messages": messages, **kwargs}
+    # tokens are accounted to the caller that made the call, not to those that waited
+    return await _chats.do(
+        request_key("chat", model, request),
+        lambda: _counted_chat(model, **request),
+    )
+
+
+async def embed(
+    texts: list[str], model: str, batched: bool = False
+) -> list[list[float]]:
+    """`batched` calls may be sent together with other sessions' (see batching.py), for
+    calls that are many and small, like the similarity scorers'."""
+    response = await _embeddings.do(
+        request_key("embed", model, {"input": texts}),
+        lambda: _counted_embed(model, texts, batched),
+    )
+    return response.embeddings
@@ -1,13 +1,22 @@
 import asyncio
 import json
-import math
+import re
 from abc import abstractmethod
-from dataclasses import dataclass, fields
+from collections import OrderedDict, defaultdict
+from dataclasses import asdict, dataclass, fields
+from functools import cache, lru_cache
 
-import ollama
 from nrclex import NRCLex
 
+import llm
+import metrics
+import similarity
+from accounting import timed_call
 from prompts import PromptNames, Prompts
+from scheduler import Priority, priority
+from similarity import Scorer, ScorerConfiguration
+from singleflight import SingleFlight, key
+from tracing import traced
 
 
 @dataclass(unsafe_hash=True)
@@ -192,13 +201,6 @@ class MetacognitiveVector(ResponseVectors):
 
     activation_threshold: float = 0.1
 
-    def should_engage_system_two(self) -> bool:
-        activation_value = self._activation_function(self.calculated_value)
-        return activation_value >= self.activation_threshold
-
-    def _activation_function(self, value: int) -> float:
-        return 1 / (1 + math.exp(-value * 0.00001))
-
     def _compute_value(self) -> int:
         return int(
             (self.emotional_response._compute_value() * self.weight_emotional_response)
@@ -218,6 +220,11 @@ class MetacognitiveVector(ResponseVectors):
         )
 
 
+# Identical scorings in flight at the same time are computed once
+_state_vectors: SingleFlight[MetacognitiveVector] = SingleFlight("msv")
+
+
+@traced("compute_metacognitive_state_vector")
 async def compute_metacognitive_state_vector(
     prompts: Prompts,
     weights: dict[str, dict[str, float]],
@@ -227,32 +234,109 @@ async def compute_metacognitive_state_vector(
     historical_responses: str = "",
     sources: str = "",
     temporal_info: str = "",
+    problem_importance: ProblemImportance | None = None,
+    scorers: ScorerConfiguration | None = None,
 ) -> MetacognitiveVector:
-    prompts = Prompts()
-    (
-        emotional_response,
-        correctness,
-        experiential_matching,
-        conflict_information,
-        problem_importance,
-    ) = await asyncio.gather(
-        _compute_emotional_response(response, weights["emotional_response"]),
-        _compute_correctness(
-            response, original_prompt, prompts, weights["correctness"]
-        ),
-        _compute_experiential_matching(
+    """Score `response` on every dimension.
+
+    Problem importance depends only on the user's prompt (`original_prompt`), so callers
+    that already scored it for this prompt (System 2, with System 1's vector) pass it in.
+    """
+    scorers = scorers or ScorerConfiguration()
+    inputs = {
+        "prompts": prompts.model_dump(),
+        "weights": weights,
+        "response": response.strip(),
+        "original_prompt": original_prompt.strip(),
+        "knowledge_base": knowledge_base,
+        "historical_responses": historical_responses,
+        "sources": sources,
+        "temporal_info": temporal_info,
+        "problem_importance": problem_importance and asdict(problem_importance),
+        "scorers": scorers.model_dump(),
+    }
+    return await _state_vectors.do(
+        key(inputs),
+        lambda: _compute_metacognitive_state_vector(
+            prompts,
+            weights,
             response,
+            original_prompt,
             knowledge_base,
             historical_responses,
-            prompts,
-            weights["experiential_matching"],
-        ),
-        _compute_conflict_information(
-            response, sources, temporal_info, prompts, weights["conflict_information"]
+            sources,
+            temporal_info,
+            problem_importance,
+            scorers,
         ),
-        _compute_problem_importance(response, prompts, weights["problem_importance"]),
     )
 
+
+async def _compute_metacognitive_state_vector(
+    prompts: Prompts,
+    weights: dict[str, dict[str, float]],
+    response: str,
+    original_prompt: str,
+    knowledge_base: str,
+    historical_responses: str,
+    sources: str,
+    temporal_info: str,
+    problem_importance: ProblemImportance | None,
+    scorers: ScorerConfiguration,
+) -> MetacognitiveVector:
+    # the response itself comes first, its scoring can wait behind other sessions' responses
+    with priority(Priority.Judge):
+        (
+            emotional_response,
+            correctness,
+            experiential_matching,
+            conflict_information,
+            problem_importance,
+        ) = await asyncio.gather(
+            timed_call(
+                "judge:emotional_response",
+                _compute_emotional_response(response, weights["emotional_response"]),
+            ),
+            timed_call(
+                "judge:correctness",
+                _compute_correctness(
+                    response, original_prompt, prompts, weights["correctness"]
+                ),
+            ),
+            timed_call(
+                "judge:experiential_matching",
+                _compute_experiential_matching(
+                    response,
+                    knowledge_base,
+                    historical_responses,
+                    prompts,
+                    weights["experiential_matching"],
+                    scorers,
+                ),
+            ),
+            timed_call(
+                "judge:conflict_information",
+                _compute_conflict_information(
+                    response,
+                    sources,
+                    temporal_info,
+                    prompts,
+                    weights["conflict_information"],
+                    scorers,
+                ),
+            ),
+            (
+                timed_call(
+                    "judge:problem_importance",
+                    _compute_problem_importance(
+                        original_prompt, prompts, weights["problem_importance"]
+                    ),
+                )
+                if problem_importance is None
+                else asyncio.sleep(0, result=problem_importance)
+            ),
+        )
+
     return MetacognitiveVector(
         emotional_response=emotional_response,
         correctness=correctness,
@@ -263,9 +347,122 @@ async def compute_metacognitive_state_vector(
     )
 
 
-async def _compute_emotional_response(
-    message: str, weights: dict[str, float]
-) -> EmotionalResponse:
+@dataclass
+class JudgeStatistics:
+    calls: int = 0
+    cache_hits: int = 0
+    # answers that weren't valid JSON the first time
+    retries: int = 0
+    # still invalid after the retry, scored as all zeros
+    failures: int = 0
+
+
+judge_statistics: defaultdict[str, JudgeStatistics] = defaultdict(JudgeStatistics)
+
+# Judge scores by rendered prompt, so the same (response, reference) pair is only scored
+# once, whichever turn or System 2 node asks again
+JUDGE_CACHE_SIZE = 1024
+_judge_scores: OrderedDict[str, dict[str, float]] = OrderedDict()
+
+
+@cache
+def _score_schema(dimension_type: type[ResponseVectors]) -> dict:
+    names = _score_names(dimension_type)
+    return {
+        "type": "object",
+        "properties": {
+            name: {"type": "number", "minimum": 0, "maximum": 100} for name in names
+        },
+        "required": list(names),
+    }
+
+
+def _extract_object(text: str) -> dict | None:
+    """The first JSON object in `text`, also when fenced or surrounded by prose."""
+    decoder = json.JSONDecoder()
+    for match in re.finditer(r"\{", text):
+        try:
+            value, _ = decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def _to_score(value) -> float | None:
+    if isinstance(value, (int, float)):
+        return min(max(float(value), 0.0), 100.0)
+    # e.g. "85" or "85/100"
+    number = re.search(r"-?\d+(?:\.\d+)?", str(value))
+    return _to_score(float(number.group())) if number else None
+
+
+def extract_scores(text: str, names: tuple[str, ...]) -> dict[str, float] | None:
+    """Scores named `names` from a judge's answer, or None when any is missing.
+
+    Falls back to picking `"name": value` pairs out of the text, for truncated JSON.
+    """
+    values = _extract_object(text) or {
+        name: match.group(1)
+        for name in names
+        if (match := re.search(rf'"{name}"\s*:\s*"?(-?\d+(?:\.\d+)?)', text))
+    }
+    scores = {name: _to_score(values.get(name)) for name in names}
+    if any(score is None for score in scores.values()):
+        return None
+    return scores
+
+
+async def _judge(dimension: str, content: str) -> dict[str, float] | None:
+    """Have the judge model score `content` for `dimension`, asking once more when the
+    answer doesn't parse. None when it still doesn't."""
+    statistics = judge_statistics[dimension]
+    statistics.calls += 1
+    if content in _judge_scores:
+        statistics.cache_hits += 1
+        metrics.cache_lookups.inc(cache="judge", result="hit")
+        _judge_scores.move_to_end(content)
+        return _judge_scores[content]
+    metrics.cache_lookups.inc(cache="judge", result="miss")
+
+    dimension_type = _DIMENSION_TYPES[dimension]
+    names = _score_names(dimension_type)
+    messages = [{"role": "user", "content": content}]
+    answer = (
+        await llm.chat(messages, format=_score_schema(dimension_type))
+    ).message.content
+    scores = extract_scores(answer, names)
+    if scores is None:
+        statistics.retries += 1
+        messages += [
+            {"role": "assistant", "content": answer},
+            {
+                "role": "user",
+                "content": f"Reply with only a JSON object with the numbers {', '.join(names)}, from 0 to 100.",
+            },
+        ]
+        answer = (
+            await llm.chat(messages, format=_score_schema(dimension_type))
+        ).message.content
+        scores = extract_scores(answer, names)
+    if scores is None:
+        # not remembered, asking again later may do better
+        statistics.failures += 1
+        return None
+
+    _judge_scores[content] = scores
+    if len(_judge_scores) > JUDGE_CACHE_SIZE:
+        _judge_scores.popitem(last=False)
+    return scores
+
+
+def _zero_scores(dimension: str) -> dict[str, float]:
+    return dict.fromkeys(_score_names(_DIMENSION_TYPES[dimension]), 0.0)
+
+
+@lru_cache(maxsize=JUDGE_CACHE_SIZE)
+def _affect_frequencies(message: str) -> tuple[tuple[str, float], ...]:
     text_object = NRCLex(message)
     # remove vestigial(?) "anticip" in favor of the populated "anticipation",
     # seems like sometimes "anticipation" is populated sometimes "anticip" ?
@@ -277,9 +474,13 @@ async def _compute_emotional_response(
         else:
             text_object.affect_frequencies["anticipation"] = 0.0
     del text_object.affect_frequencies["anticip"]
-    return EmotionalResponse(
-        **{k: v * 100 for k, v in text_object.affect_frequencies.items()}
-    )
+    return tuple(text_object.affect_frequencies.items())
+
+
+async def _compute_emotional_response(
+    message: str, weights: dict[str, float]
+) -> EmotionalResponse:
+    return EmotionalResponse(**{k: v * 100 for k, v in _affect_frequencies(message)})
 
 
 async def _compute_correctness(
@@ -289,26 +490,8 @@ async def _compute_correctness(
         PromptNames.Correctness,
         {"original_prompt": original_prompt, "message": message},
     )
-    response = ollama.chat(
-        model="llama3.2", messages=[{"role": "user", "content": content}]
-    )
-    try:
-        parsed_response = json.loads(response.message.content)
-        return CorrectnessResponse(
-            logical_consistency=parsed_response["logical_consistency"],
-            factual_accuracy=int(parsed_response["factual_accuracy"]),
-            contextual_appropriateness=int(
-                parsed_response["contextual_appropriateness"]
-            ),
-            **weights,
-        )
-    except:
-        return CorrectnessResponse(
-            logical_consistency=0.0,
-            factual_accuracy=0.0,
-            contextual_appropriateness=0.0,
-            **weights,
-        )
+    scores = await _judge("correctness", content)
+    return CorrectnessResponse(**(scores or _zero_scores("correctness")), **weights)
 
 
 # Depending how to input knowledge base and historical responses, the prompt template would be different.
@@ -319,7 +502,21 @@ async def _compute_experiential_matching(
     historical_responses: str,
     prompts: Prompts,
     weights: dict[str, float],
+    scorers: ScorerConfiguration,
 ) -> ExperientialMatchingResponse:
+    if scorers.experiential_matching == Scorer.Embedding:
+        knowledge_base_matching, historical_responses_matching = await asyncio.gather(
+            similarity.best_match(message, knowledge_base, scorers.embedding_model),
+            similarity.best_match(
+                message, historical_responses, scorers.embedding_model
+            ),
+        )
+        # no knowledge or history to match is no match
+        return ExperientialMatchingResponse(
+            knowledge_base_matching=knowledge_base_matching or 0.0,
+            historical_responses_matching=historical_responses_matching or 0.0,
+            **weights,
+        )
     content = prompts.get_prompt(
         PromptNames.Experiential_Matching,
         {
@@ -328,22 +525,31 @@ async def _compute_experiential_matching(
             "historical_responses": historical_responses,
         },
     )
-    response = ollama.chat(
-        model="llama3.2", messages=[{"role": "user", "content": content}]
+    scores = await _judge("experiential_matching", content)
+    return ExperientialMatchingResponse(
+        **(scores or _zero_scores("experiential_matching")), **weights
     )
-    try:
-        parsed_response = json.loads(response.message.content)
-        return ExperientialMatchingResponse(
-            knowledge_base_matching=float(parsed_response["knowledge_base_matching"]),
-            historical_responses_matching=float(
-                parsed_response["historical_responses_matching"]
-            ),
-            **weights,
-        )
-    except:
-        return ExperientialMatchingResponse(
-            knowledge_base_matching=0.0, historical_responses_matching=0.0, **weights
-        )
+
+
+def _fill_unscored(
+    dimension_type: type[ResponseVectors],
+    scores: dict[str, float | None],
+    weights: dict[str, float],
+) -> dict[str, float]:
+    """Give the components that couldn't be scored (None) the weighted mean of the others,
+    the same as leaving them out and scaling up the others' weights."""
+    weight = {
+        name: weights.get(f"weight_{name}", getattr(dimension_type, f"weight_{name}"))
+        for name in scores
+    }
+    scored = {name: score for name, score in scores.items() if score is not None}
+    total = sum(weight[name] for name in scored)
+    mean = (
+        sum(score * weight[name] for name, score in scored.items()) / total
+        if total
+        else 0.0
+    )
+    return {name: scores[name] if name in scored else mean for name in scores}
 
 
 async def _compute_conflict_information(
@@ -352,29 +558,34 @@ async def _compute_conflict_information(
     temporal_info: str,
     prompts: Prompts,
     weights: dict[str, float],
+    scorers: ScorerConfiguration,
 ) -> ConflictInformation:
+    if scorers.conflict_information == Scorer.Embedding:
+        internal_consistency, source_agreement, temporal_stability = (
+            await asyncio.gather(
+                similarity.internal_consistency(message, scorers.embedding_model),
+                similarity.best_match(message, sources, scorers.embedding_model),
+                similarity.best_match(message, temporal_info, scorers.embedding_model),
+            )
+        )
+        scores = _fill_unscored(
+            ConflictInformation,
+            {
+                "internal_consistency": internal_consistency,
+                "source_agreement": source_agreement,
+                "temporal_stability": temporal_stability,
+            },
+            weights,
+        )
+        return ConflictInformation(**scores, **weights)
     content = prompts.get_prompt(
         PromptNames.Conflict_Information,
         {"sources": sources, "message": message, "temporal_info": temporal_info},
     )
-    response = ollama.chat(
-        model="llama3.2", messages=[{"role": "user", "content": content}]
+    scores = await _judge("conflict_information", content)
+    return ConflictInformation(
+        **(scores or _zero_scores("conflict_information")), **weights
     )
-    try:
-        parsed_response = json.loads(response.message.content)
-        return ConflictInformation(
-            internal_consistency=float(parsed_response["internal_consistency"]),
-            source_agreement=float(parsed_response["source_agreement"]),
-            temporal_stability=float(parsed_response["temporal_stability"]),
-            **weights,
-        )
-    except:
-        return ConflictInformation(
-            internal_consistency=0.0,
-            source_agreement=0.0,
-            temporal_stability=0.0,
-            **weights,
-        )
 
 
 async def _compute_problem_importance(
@@ -383,24 +594,10 @@ async def _compute_problem_importance(
     content = prompts.get_prompt(
         PromptNames.Problem_Importance, {"original_prompt": original_prompt}
     )
-    response = ollama.chat(
-        model="llama3.2", messages=[{"role": "user", "content": content}]
+    scores = await _judge("problem_importance", content)
+    return ProblemImportance(
+        **(scores or _zero_scores("problem_importance")), **weights
     )
-    try:
-        parsed_response = json.loads(response.message.content)
-        return ProblemImportance(
-            potential_consequences=float(parsed_response["potential_consequences"]),
-            temporal_urgency=float(parsed_response["temporal_urgency"]),
-            scope_of_impact=float(parsed_response["scope_of_impact"]),
-            **weights,
-        )
-    except:
-        return ProblemImportance(
-            potential_consequences=0.0,
-            temporal_urgency=0.0,
-            scope_of_impact=0.0,
-            **weights,
-        )
 
 
 def generate_empty_msv() -> MetacognitiveVector:
@@ -436,3 +633,67 @@ def generate_empty_msv() -> MetacognitiveVector:
         conflict_information=conflict_information,
         problem_importance=problem_importance,
     )
+
+
+def get_weights(msv: MetacognitiveVector) -> dict[str, float]:
+    weights = {}
+    for x in (
+        ("msv_weights", msv),
+        ("emotional_response", msv.emotional_response),
+        ("correctness", msv.correctness),
+        ("experiential_matching", msv.experiential_matching),
+        ("conflict_information", msv.conflict_information),
+        ("problem_importance", msv.problem_importance),
+    ):
+        weights[x[0]] = {
+            k: v
+            for k, v in asdict(x[1]).items()
+            if k.startswith("weight") or k == "activation_threshold"
+        }
+    return weights
+
+
+_DIMENSION_TYPES: dict[str, type[ResponseVectors]] = {
+    "emotional_response": EmotionalResponse,
+    "correctness": CorrectnessResponse,
+    "experiential_matching": ExperientialMatchingResponse,
+    "conflict_information": ConflictInformation,
+    "problem_importance": ProblemImportance,
+}
+MSV_DIMENSIONS = tuple(_DIMENSION_TYPES)
+
+
+@cache
+def _score_names(dimension_type: type[ResponseVectors]) -> tuple[str, ...]:
+    return tuple(
+        field.name
+        for field in fields(dimension_type)
+        if field.name not in ("version", "calculated_value")
+        and not field.name.startswith("weight_")
+    )
+
+
+def compact_msv(vector: MetacognitiveVector) -> dict[str, list[float]]:
+    """Only the scores of each dimension, in field order; the weights travel separately."""
+    return {
+        dimension: [
+            getattr(getattr(vector, dimension), name)
+            for name in _score_names(dimension_type)
+        ]
+        for dimension, dimension_type in _DIMENSION_TYPES.items()
+    }
+
+
+def expand_msv(
+    compact: dict[str, list[float]], weights: dict[str, dict[str, float]]
+) -> MetacognitiveVector:
+    return MetacognitiveVector(
+        **{
+            dimension: dimension_type(
+                **dict(zip(_score_names(dimension_type), compact[dimension])),
+                **weights[dimension],
+            )
+            for dimension, dimension_type in _DIMENSION_TYPES.items()
+        },
+        **weights["msv_weights"],
+    )
@@ -0,0 +1,166 @@
+"""Process-wide counters and latency histograms, served by /metrics in the Prometheus text
+format."""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import defaultdict
+
+# seconds, from a cached judge answer up to a long System 2 deliberation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], **extra: str) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> list[str]: ...
+
+    def render(self) -> str:
+        return "\n".join(
+            [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+            + self.samples()
+        )
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, help, label_names)
+        self.values: defaultdict[tuple[str, ...], float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self.values[self._key(labels)] += amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+            for key, value in sorted(self.values.items())
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, help, label_names)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self._key(labels)] = value
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+            for key, value in sorted(self.values.items())
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, label_names)
+        self.buckets = buckets
+        # per label values: count per bucket (not cumulative), then sum and count
+        self.counts: dict[tuple[str, ...], list[int]] = {}
+        self.sums: defaultdict[tuple[str, ...], float] = defaultdict(float)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        # the first bucket whose upper bound is at least `value`, else +Inf
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.label_names, key, le=le)} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_sum{_labels(self.label_names, key)} {_number(self.sums[key])}"
+            )
+            lines.append(
+                f"{self.name}_count{_labels(self.label_names, key)} {cumulative}"
+            )
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+stage_duration = Histogram(
+    "stage_duration_seconds",
+    "Wall time of each pipeline stage (see accounting.timed)",
+    ("stage",),
+)
+llm_calls = Counter("llm_calls_total", "Model calls", ("model", "call"))
+llm_tokens = Counter("llm_tokens_total", "Model tokens", ("model", "kind"))
+cache_lookups = Counter(
+    "cache_lookups_total",
+    "Judge answer and embedding cache lookups",
+    ("cache", "result"),
+)
+llm_active_calls = Gauge(
+    "llm_active_calls", "Model calls in flight, per model", ("model",)
+)
+llm_queue_depth = Gauge(
+    "llm_queue_depth", "Model calls waiting for a slot", ("model", "priority")
+)
+llm_queue_wait = Histogram(
+    "llm_queue_wait_seconds", "Time model calls waited for a slot", ("priority",)
+)
+llm_rejected = Counter(
+    "llm_rejected_total",
+    "Model calls refused because too many were waiting",
+    ("model", "priority"),
+)
+coalesced_calls = Counter(
+    "coalesced_calls_total",
+    "Calls that did the work (leader) or waited for an identical one in flight (follower)",
+    ("flight", "role"),
+)
+system_one_turns = Counter(
+    "system_one_turns_total",
+    "Turns System 1 answered, by whether they escalated to System 2",
+    ("escalated",),
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
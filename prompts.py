@@ -1,7 +1,8 @@
 from enum import StrEnum, auto
+from functools import lru_cache
 
 from jinja2 import Environment, Template
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel
 
 
 class PromptNames(StrEnum):
@@ -21,11 +22,20 @@ class PromptNames(StrEnum):
     Generalist_User = auto()
     Synthesizer_System = auto()
     Synthesizer_User = auto()
+    Conversation_Summary = "conversation_summary_prompt"
 
 
-class Prompts(BaseModel):
-    model_config = ConfigDict(arbitrary_types_allowed=True) 
+# One environment for every session's prompts
+_environment = Environment()
+
+
+@lru_cache(maxsize=256)
+def compile_prompt(prompt_string: str) -> Template:
+    """Templates by source, so each distinct prompt (default or configured) is compiled once"""
+    return _environment.from_string(prompt_string)
 
+
+class Prompts(BaseModel):
     correctness_prompt: str = """Without citing modern fact-checks, how would you assess this claim on the dimensions of logical consistency, factual accuracy, and contextual appropriateness? 
 Consider the contextual appropriateness with the given context. 
 Assess each dimension from 0 to 100 and return the response in JSON format {"logical_consistency": "logical consistency", "factual_accuracy": "factual accuracy", "contextual_appropriateness": "contextual appropriateness"}, 
@@ -71,9 +81,12 @@ User Prompt: {{original_prompt}}"""
     synthesizer_system: str = """You are a synthesizer, you take information from disperate sources and combine it into a concise cogent response, previous information is from {{previous_node_role}}"""
     synthesizer_user: str = """Based on all conversation thus far, what is your synthesis?"""
 
-    jinja_env: Environment = Field(default_factory=Environment, exclude=True)
+    conversation_summary_prompt: str = """Summarize the conversation below in a few sentences, keeping the facts, decisions and open questions a later reply may need. Return only the summary.
+Earlier summary: {{summary}}
+Conversation:
+{{conversation}}"""
 
     def get_prompt(self, prompt: PromptNames, context: dict) -> str:
         prompt_string = getattr(self, prompt.value)
-        prompt_template: Template = self.jinja_env.from_string(prompt_string)
+        prompt_template: Template = compile_prompt(prompt_string)
         return prompt_template.render(**context)
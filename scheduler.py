@@ -0,0 +1,162 @@
+"""Coordinates model calls across every session, so the model server isn't swamped and
+interactive work doesn't queue behind background work.
+
+Each model gets a number of slots (calls in flight). When they're taken, calls wait in
+priority order, then arrival order; when too many are waiting, new calls are refused
+with `Overloaded` rather than queued without bound.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter
+from collections.abc import AsyncIterator, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+
+import metrics
+
+
+class Priority(IntEnum):
+    # lower runs first
+    Interactive = 0
+    System_Two = 1
+    Judge = 2
+    Experiment = 3
+
+    @property
+    def label(self) -> str:
+        return self.name.lower()
+
+    @classmethod
+    def from_label(cls, label: str | None, default: "Priority") -> "Priority":
+        return next((priority for priority in cls if priority.label == label), default)
+
+
+class Overloaded(Exception):
+    """Too many calls are already waiting for this model."""
+
+
+_priority: ContextVar[Priority] = ContextVar("priority", default=Priority.Interactive)
+
+
+@contextmanager
+def priority(level: Priority) -> Iterator[None]:
+    """Model calls made inside wait as `level`, unless they already wait as a lower
+    priority (e.g. the judges of an experiment wait as experiment work)."""
+    token = _priority.set(max(_priority.get(), level))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> Priority:
+    return _priority.get()
+
+
+class ModelQueue:
+    def __init__(self, model: str, slots: int, max_waiting: int):
+        self.model = model
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting: list[tuple[Priority, int, asyncio.Future]] = []
+        self.depth: Counter[Priority] = Counter()
+        self._arrivals = itertools.count()
+
+    def _update_depth(self, level: Priority, change: int) -> None:
+        self.depth[level] += change
+        metrics.llm_queue_depth.set(
+            self.depth[level], model=self.model, priority=level.label
+        )
+
+    async def acquire(self, level: Priority) -> None:
+        if self.active < self.slots and not self.waiting:
+            self.active += 1
+            metrics.llm_active_calls.set(self.active, model=self.model)
+            return
+        if len(self.waiting) >= self.max_waiting:
+            metrics.llm_rejected.inc(model=self.model, priority=level.label)
+            raise Overloaded(
+                f"{len(self.waiting)} calls already waiting for {self.model}"
+            )
+
+        entry = (
+            level,
+            next(self._arrivals),
+            asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(self.waiting, entry)
+        self._update_depth(level, 1)
+        try:
+            # resolved by `release`, handing over its slot
+            await entry[2]
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled():
+                # the slot was handed over just as this was cancelled, pass it on
+                self.release()
+            elif entry in self.waiting:
+                # else `release` already popped it, and skipped it as cancelled
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self._update_depth(level, -1)
+            raise
+
+    def release(self) -> None:
+        while self.waiting:
+            level, _, future = heapq.heappop(self.waiting)
+            self._update_depth(level, -1)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+        metrics.llm_active_calls.set(self.active, model=self.model)
+
+
+class Scheduler:
+    def __init__(
+        self,
+        slots: int = 4,
+        model_slots: dict[str, int] | None = None,
+        max_waiting: int = 256,
+    ):
+        self.slots = slots
+        self.model_slots = model_slots or {}
+        self.max_waiting = max_waiting
+        self.queues: dict[str, ModelQueue] = {}
+
+    def queue(self, model: str) -> ModelQueue:
+        if model not in self.queues:
+            self.queues[model] = ModelQueue(
+                model, self.model_slots.get(model, self.slots), self.max_waiting
+            )
+        return self.queues[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str) -> AsyncIterator[None]:
+        """Hold one of `model`'s slots, waiting for it at the current priority."""
+        queue = self.queue(model)
+        level = current_priority()
+        start = time.perf_counter()
+        await queue.acquire(level)
+        metrics.llm_queue_wait.observe(
+            time.perf_counter() - start, priority=level.label
+        )
+        try:
+            yield
+        finally:
+            queue.release()
+
+
+# Replaced by `configure` with the command line's limits
+scheduler = Scheduler()
+
+
+def configure(
+    slots: int, model_slots: dict[str, int] | None = None, max_waiting: int = 256
+) -> None:
+    global scheduler
+    scheduler = Scheduler(slots, model_slots, max_waiting)
@@ -0,0 +1,95 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from conversation import ContextConfiguration, Conversation
+from escalation import EscalationConfiguration
+from history import create_database_and_table
+from prompts import Prompts
+from similarity import ScorerConfiguration
+from system_communication_objects import SystemTwoSettings, settings_id
+from system_two_configuration import SystemTwoConfiguration
+
+
+@dataclass
+class Session:
+    """Everything one conversation needs: its configuration, history and database."""
+
+    # None when the session database couldn't be created, so nothing is recorded
+    session_id: str | None
+    prompts: Prompts
+    weights: dict[str, dict[str, float]]
+    system_two: SystemTwoConfiguration
+    scorers: ScorerConfiguration
+    escalation: EscalationConfiguration
+    context: ContextConfiguration = field(default_factory=ContextConfiguration)
+    conversation: Conversation = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.conversation = Conversation(self.context, self.prompts)
+
+    @property
+    def db_file(self) -> str:
+        return f"data/{self.session_id}.sqlite3"
+
+    @property
+    def configuration(self) -> dict[str, dict[str, Any]]:
+        return self.weights | {
+            "prompts": self.prompts.model_dump(),
+            "system_two": self.system_two.model_dump(mode="json"),
+            "scorers": self.scorers.model_dump(mode="json"),
+            "escalation": self.escalation.model_dump(mode="json"),
+        }
+
+    # a session's configuration never changes (/reset makes a new session), so System 2 can
+    # cache it under this id
+    @cached_property
+    def system_two_settings(self) -> SystemTwoSettings:
+        return SystemTwoSettings(
+            prompts=self.prompts,
+            weights=self.weights,
+            system_two=self.system_two,
+            scorers=self.scorers,
+        )
+
+    @cached_property
+    def system_two_settings_id(self) -> str:
+        return settings_id(self.system_two_settings)
+
+
+def _new_session_id(existing: set[str]) -> str:
+    session_id = datetime.now(timezone.utc).strftime("%Y-%m-%d_%H_%M_%S_%f")
+    # sessions created concurrently can land on the same microsecond
+    suffix = 1
+    while session_id in existing or Path(f"data/{session_id}.sqlite3").exists():
+        session_id = (
+            f"{datetime.now(timezone.utc).strftime('%Y-%m-%d_%H_%M_%S_%f')}_{suffix}"
+        )
+        suffix += 1
+    return session_id
+
+
+def create_session(
+    prompts: Prompts,
+    weights: dict[str, dict[str, float]],
+    system_two: SystemTwoConfiguration,
+    scorers: ScorerConfiguration,
+    escalation: EscalationConfiguration,
+    existing: set[str],
+    context: ContextConfiguration | None = None,
+) -> Session:
+    Path("data").mkdir(parents=True, exist_ok=True)
+    session = Session(
+        session_id=_new_session_id(existing),
+        prompts=prompts,
+        weights=weights,
+        system_two=system_two,
+        scorers=scorers,
+        escalation=escalation,
+        context=context or ContextConfiguration(),
+    )
+    if not create_database_and_table(session.db_file, session.configuration):
+        session.session_id = None
+    return session
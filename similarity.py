@@ -0,0 +1,93 @@
+import re
+from collections import OrderedDict
+from enum import StrEnum, auto
+
+import numpy as np
+from pydantic import BaseModel
+
+import llm
+import metrics
+
+DEFAULT_EMBEDDING_MODEL = "nomic-embed-text"
+
+
+class Scorer(StrEnum):
+    # ask the judge model
+    Llm = auto()
+    # cosine similarity of sentence embeddings, milliseconds instead of a model call
+    Embedding = auto()
+
+
+class ScorerConfiguration(BaseModel):
+    """Which backend scores the MSV dimensions that are, at heart, similarity judgments."""
+
+    experiential_matching: Scorer = Scorer.Llm
+    conflict_information: Scorer = Scorer.Llm
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL
+
+
+# Embeddings by (model, text), so each historical message or knowledge chunk is embedded once
+EMBEDDING_CACHE_SIZE = 4096
+_embeddings: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+
+
+async def embed(texts: list[str], model: str) -> np.ndarray:
+    """Unit-length embeddings of `texts`, one row each, only embedding the uncached ones."""
+    vectors: dict[str, np.ndarray] = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        if (model, text) in _embeddings:
+            _embeddings.move_to_end((model, text))
+            vectors[text] = _embeddings[(model, text)]
+        else:
+            missing.append(text)
+    metrics.cache_lookups.inc(len(vectors), cache="embedding", result="hit")
+    metrics.cache_lookups.inc(len(missing), cache="embedding", result="miss")
+    if missing:
+        for text, embedding in zip(
+            missing, await llm.embed(missing, model, batched=True)
+        ):
+            vector = np.asarray(embedding, dtype=float)
+            vectors[text] = vector / (np.linalg.norm(vector) or 1)
+            _embeddings[(model, text)] = vectors[text]
+        while len(_embeddings) > EMBEDDING_CACHE_SIZE:
+            _embeddings.popitem(last=False)
+    return np.stack([vectors[text] for text in texts])
+
+
+def _passages(text: str) -> list[str]:
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def _sentences(text: str) -> list[str]:
+    return [
+        sentence.strip()
+        for sentence in re.split(r"(?<=[.!?])\s+", text)
+        if sentence.strip()
+    ]
+
+
+def _score(similarity: float) -> float:
+    """cosine similarity -> 0-100, like the judges' scores; dissimilar isn't negative"""
+    return max(similarity, 0.0) * 100
+
+
+async def best_match(message: str, reference: str, model: str) -> float | None:
+    """How well `message` matches the closest passage (line) of `reference`, 0-100. None
+    when `reference` is empty, there's nothing to match."""
+    passages = _passages(reference)
+    if not passages:
+        return None
+    if not message.strip():
+        return 0.0
+    vectors = await embed([message] + passages, model)
+    return _score(float((vectors[1:] @ vectors[0]).max()))
+
+
+async def internal_consistency(message: str, model: str) -> float:
+    """How closely consecutive sentences of `message` agree, 0-100."""
+    sentences = _sentences(message)
+    if len(sentences) < 2:
+        return 100.0
+    vectors = await embed(sentences, model)
+    return _score(float(np.einsum("ij,ij->i", vectors[:-1], vectors[1:]).mean()))
@@ -0,0 +1,44 @@
+"""Coalescing of concurrent identical work: while a result is being computed, identical
+calls wait for it instead of computing it again, e.g. when several experiment workers send
+the same prompt at once."""
+
+import asyncio
+import hashlib
+import json
+from collections.abc import Awaitable, Callable
+from typing import Any, Generic, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+
+def key(value: Any) -> str:
+    """Hash of `value`, independent of key order; objects json can't encode count by str."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self, name: str):
+        self.name = name
+        self.flights: dict[str, asyncio.Future[T]] = {}
+
+    async def do(self, key: str, function: Callable[[], Awaitable[T]]) -> T:
+        """The result of `function()`, or of the identical call already in flight."""
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = asyncio.ensure_future(function())
+            flight.add_done_callback(lambda _: self._land(key, flight))
+            metrics.coalesced_calls.inc(flight=self.name, role="leader")
+        else:
+            metrics.coalesced_calls.inc(flight=self.name, role="follower")
+        # one caller giving up doesn't cancel the work the others are waiting for
+        return await asyncio.shield(flight)
+
+    def _land(self, key: str, flight: asyncio.Future[T]) -> None:
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if not flight.cancelled():
+            # retrieved, so it isn't reported as unhandled when every caller gave up
+            flight.exception()
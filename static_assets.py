@@ -0,0 +1,208 @@
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+from bokeh.core.has_props import HasProps
+from bokeh.models import Plot
+from bokeh.models.text import MathText
+from bokeh.models.widgets import TableWidget, Widget
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BOKEH_VERSION = "3.8.0"
+
+# Hashed URLs never change content, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Un-hashed URLs must be revalidated (cheap 304s via ETag/Last-Modified)
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Files smaller than this aren't worth a compressed variant
+MINIMUM_COMPRESSIBLE_SIZE = 1024
+COMPRESSIBLE_SUFFIXES = {".js", ".css", ".html", ".json", ".svg", ".txt"}
+
+
+@dataclass(frozen=True)
+class StaticAsset:
+    path: Path
+    hashed_name: str
+    media_type: str
+    # encoding ("br", "gzip") -> precompressed file
+    variants: dict[str, Path]
+
+
+def _hashed_name(name: str, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, suffix = os.path.splitext(name)
+    return f"{stem}.{digest}{suffix}"
+
+
+def _write_variant(target: Path, content: bytes, encoding: str) -> bool:
+    if target.exists():
+        return True
+    if encoding == "br":
+        compressed = brotli.compress(content, quality=11)
+    else:
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(compressed) >= len(content):
+        return False
+    # write-then-rename so a concurrent startup never serves a partial file
+    temporary = target.with_suffix(target.suffix + ".tmp")
+    temporary.write_bytes(compressed)
+    temporary.replace(target)
+    return True
+
+
+def build_static_assets(
+    static_directory: str | Path, build_directory: str | Path
+) -> dict[str, StaticAsset]:
+    """Hash every static file and write gzip (and brotli, when available) variants.
+
+    Variants are named after the content hash, so existing ones are reused across restarts
+    and only changed files are recompressed.
+    """
+    static_directory = Path(static_directory)
+    build_directory = Path(build_directory)
+    build_directory.mkdir(parents=True, exist_ok=True)
+    encodings = ["br", "gzip"] if brotli else ["gzip"]
+
+    assets: dict[str, StaticAsset] = {}
+    for path in sorted(static_directory.rglob("*")):
+        if not path.is_file():
+            continue
+        name = path.relative_to(static_directory).as_posix()
+        content = path.read_bytes()
+        hashed_name = _hashed_name(name, content)
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        variants: dict[str, Path] = {}
+        if (
+            path.suffix in COMPRESSIBLE_SUFFIXES
+            and len(content) >= MINIMUM_COMPRESSIBLE_SIZE
+        ):
+            for encoding in encodings:
+                extension = "br" if encoding == "br" else "gz"
+                target = build_directory / f"{hashed_name.replace('/', '_')}.{extension}"
+                if _write_variant(target, content, encoding):
+                    variants[encoding] = target
+
+        assets[name] = StaticAsset(
+            path=path, hashed_name=hashed_name, media_type=media_type, variants=variants
+        )
+    return assets
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, *parameters = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            if parameter.startswith("q="):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves content-hashed URLs with precompressed variants.
+
+    `/static/bokeh-3.8.0.min.<hash>.js` is served (brotli or gzip, per Accept-Encoding) with an
+    immutable cache header; the plain `/static/bokeh-3.8.0.min.js` URL still works but must be
+    revalidated.
+    """
+
+    def __init__(self, *, directory: str, build_directory: str, **kwargs) -> None:
+        super().__init__(directory=directory, **kwargs)
+        self.assets = build_static_assets(directory, build_directory)
+        self.hashed_names = {
+            asset.hashed_name: name for name, asset in self.assets.items()
+        }
+
+    def hashed_asset(self, name: str) -> str:
+        """Jinja helper: map a static file name to its content-hashed URL path."""
+        asset = self.assets.get(name)
+        return asset.hashed_name if asset else name
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        name = self.hashed_names.get(path)
+        immutable = name is not None
+        asset = self.assets.get(name if immutable else path)
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        request_headers = Headers(scope=scope)
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        headers = {
+            "Cache-Control": (
+                IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+            )
+        }
+        file_path = asset.path
+        if asset.variants:
+            headers["Vary"] = "Accept-Encoding"
+            for encoding, variant_path in asset.variants.items():
+                if encoding in accepted:
+                    headers["Content-Encoding"] = encoding
+                    file_path = variant_path
+                    break
+
+        response = FileResponse(
+            file_path,
+            media_type=asset.media_type,
+            headers=headers,
+            stat_result=os.stat(file_path),
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def bokeh_bundles(objs: list[HasProps]) -> list[str]:
+    """The optional Bokeh sub-bundles the given models need, beyond the core bokeh bundle."""
+    references: set[HasProps] = set()
+    for obj in objs:
+        references |= obj.references()
+
+    bundles = []
+    if any(isinstance(obj, Plot) and obj.output_backend == "webgl" for obj in references):
+        bundles.append("gl")
+    if any(isinstance(obj, Widget) for obj in references):
+        bundles.append("widgets")
+    if any(isinstance(obj, TableWidget) for obj in references):
+        bundles.append("tables")
+    if any(isinstance(obj, MathText) for obj in references):
+        bundles.append("mathjax")
+    return [f"bokeh-{bundle}-{BOKEH_VERSION}.min.js" for bundle in bundles]
+
+
+if __name__ == "__main__":
+    # Build-time entry point, so deployments can precompress before the first start
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--static-directory", default="static")
+    parser.add_argument("--build-directory", default="build/static")
+    args = parser.parse_args()
+
+    for name, asset in build_static_assets(
+        args.static_directory, args.build_directory
+    ).items():
+        sizes = ", ".join(
+            f"{encoding}: {path.stat().st_size}"
+            for encoding, path in asset.variants.items()
+        )
+        print(f"{name} -> {asset.hashed_name} ({asset.path.stat().st_size} {sizes})")
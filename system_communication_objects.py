@@ -1,12 +1,30 @@
-from pydantic import BaseModel
+import hashlib
+
+from pydantic import BaseModel, Field
 
-from metacognitive import MetacognitiveVector
 from prompts import Prompts
+from similarity import ScorerConfiguration
+from system_two_configuration import SystemTwoConfiguration
+
+
+class SystemTwoSettings(BaseModel):
+    """Everything about a session System 2 needs, which only changes on /reset."""
 
-class SystemTwoRequest(BaseModel):
-    user_prompt: str
-    system_one_response: str
-    metacognitive_vector: MetacognitiveVector
     prompts: Prompts
     weights: dict[str, dict[str, float]]
+    system_two: SystemTwoConfiguration = Field(default_factory=SystemTwoConfiguration)
+    scorers: ScorerConfiguration = Field(default_factory=ScorerConfiguration)
 
+
+def settings_id(settings: SystemTwoSettings) -> str:
+    return hashlib.sha256(settings.model_dump_json().encode()).hexdigest()[:16]
+
+
+class SystemTwoRequest(BaseModel):
+    user_prompt: str
+    system_one_response: str
+    # scores only (`metacognitive.compact_msv`), the weights are part of the settings
+    metacognitive_vector: dict[str, list[float]]
+    settings_id: str
+    # left out once System 2 has cached these settings
+    settings: SystemTwoSettings | None = None
@@ -1,5 +1,8 @@
-import ollama
+import llm
+
 
 async def get_response(message: str, historical_messages: list[dict]) -> str:
-    response = ollama.chat(model="llama3.2", messages=historical_messages + [{"role": "user", "content":message}])
+    response = await llm.chat(
+        historical_messages + [{"role": "user", "content": message}]
+    )
     return response.message.content
@@ -0,0 +1,75 @@
+from enum import StrEnum, auto
+
+from pydantic import BaseModel, Field, field_validator
+
+from llm import DEFAULT_MODEL
+
+
+class NodeRole(StrEnum):
+    Domain_Expert = auto()
+    Critic = auto()
+    Evaluator = auto()
+    Generalist = auto()
+    Synthesizer = auto()
+
+
+class NodeConfiguration(BaseModel):
+    # None leaves generation length to the model's default
+    max_tokens: int | None = None
+
+
+class RoleConfiguration(BaseModel):
+    model: str = DEFAULT_MODEL
+
+
+class DeliberationConfiguration(BaseModel):
+    """When System 2 may stop before running every assigned node (and the synthesis)."""
+
+    # opt in: stopping early changes System 2's answer from the synthesis to a node's
+    early_exit: bool = False
+    # nodes that always run before the policy may stop
+    min_nodes: int = Field(default=1, ge=1)
+    # stop once a node's correctness score reaches this (0-100), None disables
+    stop_correctness: int | None = 80
+    # stop once no MSV dimension moved more than this between consecutive nodes, None disables
+    convergence_tolerance: float | None = 5.0
+    # passes over the assigned nodes when the last one still hasn't cleared the bar
+    max_rounds: int = Field(default=1, ge=1)
+
+
+def _default_nodes() -> list[NodeConfiguration]:
+    return [NodeConfiguration(), NodeConfiguration()]
+
+
+def _default_roles() -> dict[NodeRole, RoleConfiguration]:
+    return {role: RoleConfiguration() for role in NodeRole}
+
+
+class SystemTwoConfiguration(BaseModel):
+    """The System 2 topology: how many nodes deliberate, which roles they may take and which
+    model each role runs on, e.g. a small fast model for the Critic and a larger one for the
+    Synthesizer.
+    """
+
+    nodes: list[NodeConfiguration] = Field(default_factory=_default_nodes, min_length=1)
+    # only these roles are assigned
+    roles: dict[NodeRole, RoleConfiguration] = Field(default_factory=_default_roles)
+    # the final answer, when no node was assigned the Synthesizer role
+    synthesis_model: str = DEFAULT_MODEL
+    synthesis_max_tokens: int | None = None
+    deliberation: DeliberationConfiguration = Field(
+        default_factory=DeliberationConfiguration
+    )
+
+    @field_validator("roles")
+    @classmethod
+    def _at_least_one_role(
+        cls, roles: dict[NodeRole, RoleConfiguration]
+    ) -> dict[NodeRole, RoleConfiguration]:
+        if not roles:
+            raise ValueError("System 2 needs at least one role")
+        return roles
+
+
+def generation_options(max_tokens: int | None) -> dict | None:
+    return {"num_predict": max_tokens} if max_tokens else None
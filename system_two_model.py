@@ -1,19 +1,33 @@
 from enum import StrEnum, auto
-
-import ollama
-from pydantic import BaseModel
-
-from metacognitive import MetacognitiveVector, compute_metacognitive_state_vector
+from functools import cached_property
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+import llm
+from accounting import timed
+from experiment_model import StageTiming
+from metacognitive import (
+    MSV_DIMENSIONS,
+    MetacognitiveVector,
+    compute_metacognitive_state_vector,
+    expand_msv,
+)
 from prompts import PromptNames, Prompts
-from system_communication_objects import SystemTwoRequest
-
-
-class NodeRole(StrEnum):
-    Domain_Expert = auto()
-    Critic = auto()
-    Evaluator = auto()
-    Generalist = auto()
-    Synthesizer = auto()
+from similarity import ScorerConfiguration
+from system_communication_objects import (
+    SystemTwoRequest,
+    SystemTwoSettings,
+    settings_id,
+)
+from system_two_configuration import (
+    DeliberationConfiguration,
+    NodeConfiguration,
+    NodeRole,
+    SystemTwoConfiguration,
+    generation_options,
+)
+from tracing import traced
 
 
 class NodeResponse(BaseModel):
@@ -25,14 +39,77 @@ class NodeResponse(BaseModel):
         frozen = True
 
 
+class DeliberationDecision(StrEnum):
+    Stop = auto()
+    Continue = auto()
+    Add_Round = auto()
+
+
+class DeliberationStep(BaseModel):
+    round: int
+    node_role: str
+    decision: DeliberationDecision
+    reason: str
+
+
 class SystemTwoResponse(BaseModel):
     system_two_response: str | None
     metacognitive_vector: MetacognitiveVector | None
     node_responses: list[NodeResponse] | None
+    # what the deliberation policy decided after each node
+    deliberation: list[DeliberationStep] = Field(default=[])
+    # stages measured inside System 2, so System 1 can account for them
+    timings: list[StageTiming] = Field(default=[])
+
+
+def msv_dimension_values(vector: MetacognitiveVector) -> np.ndarray:
+    return np.array(
+        [getattr(vector, dimension).calculated_value for dimension in MSV_DIMENSIONS],
+        dtype=float,
+    )
+
+
+def deliberate(
+    policy: DeliberationConfiguration,
+    node_msv: MetacognitiveVector,
+    previous_node_msv: MetacognitiveVector | None,
+    nodes_run: int,
+    last_in_round: bool,
+    round_number: int,
+) -> tuple[DeliberationDecision, str]:
+    """Decide, from the MSV of the node that just ran, whether System 2 has deliberated
+    enough."""
+    if policy.early_exit and nodes_run >= policy.min_nodes:
+        correctness = node_msv.correctness.calculated_value
+        if (
+            policy.stop_correctness is not None
+            and correctness >= policy.stop_correctness
+        ):
+            return (
+                DeliberationDecision.Stop,
+                f"correctness {correctness} reached {policy.stop_correctness}",
+            )
+        if policy.convergence_tolerance is not None and previous_node_msv is not None:
+            change = np.abs(
+                msv_dimension_values(node_msv) - msv_dimension_values(previous_node_msv)
+            ).max()
+            if change <= policy.convergence_tolerance:
+                return (
+                    DeliberationDecision.Stop,
+                    f"converged, largest MSV dimension change {change:g} is within {policy.convergence_tolerance:g}",
+                )
+    if last_in_round and round_number < policy.max_rounds:
+        return (
+            DeliberationDecision.Add_Round,
+            f"not converged after round {round_number} of {policy.max_rounds}",
+        )
+    return DeliberationDecision.Continue, "not converged"
 
 
 class Node:
-    role: NodeRole = NodeRole.Generalist
+    def __init__(self, configuration: NodeConfiguration | None = None):
+        self.configuration = configuration or NodeConfiguration()
+
     # TODO adjust weights!
     role_weights: dict[NodeRole, dict[str, float]] = {
         NodeRole.Domain_Expert: {
@@ -72,38 +149,40 @@ class Node:
         },
     }
 
+    @cached_property
+    def role_weight_matrix(self) -> np.ndarray:
+        """roles × MSV dimensions, rows in `NodeRole` order"""
+        return np.array(
+            [
+                [
+                    self.role_weights[role].get(dimension, 0.0)
+                    for dimension in MSV_DIMENSIONS
+                ]
+                for role in NodeRole
+            ]
+        )
+
     def get_role_preferences(
         self, system_one_vector: MetacognitiveVector
     ) -> dict[NodeRole, float]:
-        role_preferences: dict[NodeRole, float] = {}
-        for role, weights in self.role_weights.items():
-            running_value = 0.0
-            for vector_name, weight in weights.items():
-                # maybe find a better way to do this than a really flexi-typed accessor into ResponseVectors
-                running_value += (
-                    weight * getattr(system_one_vector, vector_name).calculated_value
-                )
-            role_preferences[role] = running_value
-        return role_preferences
-
-    def assign_role(self, new_role: NodeRole) -> None:
-        # TODO? keep role history?
-        # TODO? update role weights?
-        self.role = new_role
+        preferences = self.role_weight_matrix @ msv_dimension_values(system_one_vector)
+        return dict(zip(NodeRole, preferences.tolist()))
 
-    def get_response(
+    async def get_response(
         self,
+        role: NodeRole,
         user_prompt: str,
         previous_node_response: str,
         previous_node_role: NodeRole,
         prompts: Prompts,
+        model: str = llm.DEFAULT_MODEL,
     ) -> str:
 
         messages = [
             {
                 "role": "system",
                 "content": prompts.get_prompt(
-                    PromptNames(f"{self.role}_system"),
+                    PromptNames(f"{role}_system"),
                     context={"previous_node_role": previous_node_role},
                 ),
                 "thinking": "true",
@@ -112,54 +191,53 @@ class Node:
             {
                 "role": "user",
                 "content": prompts.get_prompt(
-                    PromptNames(f"{self.role}_user"),
+                    PromptNames(f"{role}_user"),
                     context={"user_prompt": user_prompt},
                 ),
             },
         ]
 
-        response = ollama.chat(model="llama3.2", messages=messages)
+        response = await llm.chat(
+            messages,
+            model=model,
+            options=generation_options(self.configuration.max_tokens),
+        )
         return response.message.content
 
 
 class SystemTwo:
-    def __init__(self):
-        self.nodes = [Node(), Node()]
-        self.taken_roles: dict[NodeRole, Node | None] = {
-            NodeRole.Domain_Expert: None,
-            NodeRole.Critic: None,
-            NodeRole.Evaluator: None,
-            NodeRole.Generalist: None,
-            NodeRole.Synthesizer: None,
-        }
-
-    def _reset_taken_nodes(self) -> None:
-        self.taken_roles: dict[NodeRole, Node | None] = {
-            NodeRole.Domain_Expert: None,
-            NodeRole.Critic: None,
-            NodeRole.Evaluator: None,
-            NodeRole.Generalist: None,
-            NodeRole.Synthesizer: None,
+    def __init__(self, configuration: SystemTwoConfiguration | None = None):
+        self.configuration = configuration or SystemTwoConfiguration()
+        self.nodes = [Node(node) for node in self.configuration.nodes]
+        # allowed roles, in `NodeRole` (i.e. running) order
+        self.roles = [role for role in NodeRole if role in self.configuration.roles]
+        self._role_indices = [list(NodeRole).index(role) for role in self.roles]
+
+    def _transition_nodes(
+        self, system_one_vector: MetacognitiveVector
+    ) -> dict[NodeRole, Node]:
+        """Assign each node at most one role (and each role at most one node): the nodes, in
+        order, take the most preferred roles still free.
+
+        Only the configured roles are considered. Returns the taken roles in `NodeRole`
+        order, which is the order the nodes run in. The
+        assignment is per call rather than stored on the nodes, so concurrent requests don't
+        see each other's roles.
+        """
+        # every node has the same role weights, so one roles × dimensions @ dimensions
+        preferences = self.nodes[0].role_weight_matrix[
+            self._role_indices
+        ] @ msv_dimension_values(system_one_vector)
+        # most preferred first, ties in `NodeRole` order
+        role_indices = np.argsort(-preferences, kind="stable")[: len(self.nodes)]
+
+        assigned = {
+            self.roles[role_index]: node
+            for node, role_index in zip(self.nodes, role_indices)
         }
+        return {role: assigned[role] for role in self.roles if role in assigned}
 
-    def _transition_nodes(self, system_one_vector: MetacognitiveVector):
-        self._reset_taken_nodes()
-
-        for node in self.nodes:
-            # TODO: manage role balance w/ Hungarian algo, right now use first available
-            role_preferences = node.get_role_preferences(system_one_vector)
-            sorted_role_preferences = [
-                role
-                for role, _ in sorted(
-                    role_preferences.items(), key=lambda r: r[1], reverse=True
-                )
-            ]
-            for role in sorted_role_preferences:
-                if self.taken_roles[role] == None:
-                    self.taken_roles[role] = node
-                    node.assign_role(role)
-                    break
-
+    @traced("SystemTwo.get_response")
     async def get_response(
         self,
         user_prompt: str,
@@ -167,6 +245,7 @@ class SystemTwo:
         system_one_vector: MetacognitiveVector,
         prompts: Prompts,
         weights,
+        scorers: ScorerConfiguration | None = None,
     ) -> SystemTwoResponse:
 
         messages = [
@@ -180,21 +259,40 @@ class SystemTwo:
             {"role": "assistant", "content": system_one_response},
         ]
 
-        self._transition_nodes(system_one_vector)
+        taken_roles = self._transition_nodes(system_one_vector)
+        policy = self.configuration.deliberation
 
         role_responses: list[NodeResponse] = []
+        deliberation: list[DeliberationStep] = []
         previous_response = system_one_response
         previous_role = "system one"
+        previous_msv: MetacognitiveVector | None = None
         synthesizer_response: str | None = None
         synthesizer_msv: MetacognitiveVector | None = None
-        for role, node in self.taken_roles.items():
-            if node:
-                node_response = node.get_response(
-                    user_prompt, previous_response, previous_role, prompts
-                )
+        # what the last node's and the Synthesizer's responses were scored against
+        previous_reference = synthesizer_reference = system_one_response
+        decision = DeliberationDecision.Add_Round
+        round_number = 0
+        while decision == DeliberationDecision.Add_Round:
+            round_number += 1
+            for index, (role, node) in enumerate(taken_roles.items()):
+                with timed(f"node:{role}"):
+                    node_response = await node.get_response(
+                        role,
+                        user_prompt,
+                        previous_response,
+                        previous_role,
+                        prompts,
+                        model=self.configuration.roles[role].model,
+                    )
 
                 state = await compute_metacognitive_state_vector(
-                    prompts, weights, node_response, previous_response
+                    prompts,
+                    weights,
+                    node_response,
+                    previous_response,
+                    problem_importance=system_one_vector.problem_importance,
+                    scorers=scorers,
                 )
                 role_responses.append(
                     NodeResponse(
@@ -204,11 +302,39 @@ class SystemTwo:
                 if role == NodeRole.Synthesizer:
                     synthesizer_response = node_response
                     synthesizer_msv = state
+                    synthesizer_reference = previous_response
 
+                previous_reference = previous_response
                 previous_response = node_response
                 previous_role = role
                 messages.append({"role": "assistant", "content": node_response})
-        if not synthesizer_response:
+
+                decision, reason = deliberate(
+                    policy,
+                    state,
+                    previous_msv,
+                    len(role_responses),
+                    index == len(taken_roles) - 1,
+                    round_number,
+                )
+                deliberation.append(
+                    DeliberationStep(
+                        round=round_number,
+                        node_role=role,
+                        decision=decision,
+                        reason=reason,
+                    )
+                )
+                previous_msv = state
+                if decision == DeliberationDecision.Stop:
+                    break
+
+        if decision == DeliberationDecision.Stop:
+            # the last node already cleared the bar, its answer is the answer
+            overall_system_two_response = previous_response
+            state = previous_msv
+            reference = previous_reference
+        elif not synthesizer_response:
             messages.append(
                 {
                     "role": "user",
@@ -219,31 +345,89 @@ class SystemTwo:
                 }
             )
 
-            overall_system_two_response = ollama.chat(
-                model="llama3.2", messages=messages
-            ).message.content
+            with timed("synthesis"):
+                overall_system_two_response = (
+                    await llm.chat(
+                        messages,
+                        model=self.configuration.synthesis_model,
+                        options=generation_options(
+                            self.configuration.synthesis_max_tokens
+                        ),
+                    )
+                ).message.content
             state = await compute_metacognitive_state_vector(
-                prompts, weights, overall_system_two_response, system_one_response
+                prompts,
+                weights,
+                overall_system_two_response,
+                system_one_response,
+                problem_importance=system_one_vector.problem_importance,
+                scorers=scorers,
             )
+            reference = system_one_response
         else:
             overall_system_two_response = synthesizer_response
             state = synthesizer_msv
+            reference = synthesizer_reference
+        if reference != system_one_response:
+            # nodes are scored against the node before them, the answer against System 1's
+            # response like the synthesis, however deliberation ended
+            state = await compute_metacognitive_state_vector(
+                prompts,
+                weights,
+                overall_system_two_response,
+                system_one_response,
+                problem_importance=system_one_vector.problem_importance,
+                scorers=scorers,
+            )
 
         return SystemTwoResponse(
             node_responses=role_responses,
             system_two_response=overall_system_two_response,
             metacognitive_vector=state,
+            deliberation=deliberation,
         )
 
 
-system_two = SystemTwo()
+class UnknownSettingsError(KeyError):
+    """The request only named its settings and they aren't cached (e.g. after a restart)."""
+
+
+class SettingsMismatchError(ValueError):
+    """The settings sent don't hash to the id sent with them."""
+
+
+# settings System 1 has sent, by id, with the SystemTwo built for them
+_settings: dict[str, tuple[SystemTwoSettings, SystemTwo]] = {}
+MAX_CACHED_SETTINGS = 64
+
+
+def _resolve_settings(
+    system_two_request: SystemTwoRequest,
+) -> tuple[SystemTwoSettings, SystemTwo]:
+    if system_two_request.settings is None:
+        if system_two_request.settings_id not in _settings:
+            raise UnknownSettingsError(system_two_request.settings_id)
+        return _settings[system_two_request.settings_id]
+
+    settings = system_two_request.settings
+    # cached under the id later requests will send, once it's known to name these settings
+    key = system_two_request.settings_id
+    if settings_id(settings) != key:
+        raise SettingsMismatchError(key)
+    if key not in _settings:
+        if len(_settings) >= MAX_CACHED_SETTINGS:
+            del _settings[next(iter(_settings))]
+        _settings[key] = (settings, SystemTwo(settings.system_two))
+    return _settings[key]
 
 
 async def get_response(system_two_request: SystemTwoRequest) -> SystemTwoResponse:
+    settings, system_two = _resolve_settings(system_two_request)
     return await system_two.get_response(
         system_two_request.user_prompt,
         system_two_request.system_one_response,
-        system_two_request.metacognitive_vector,
-        system_two_request.prompts,
-        system_two_request.weights,
+        expand_msv(system_two_request.metacognitive_vector, settings.weights),
+        settings.prompts,
+        settings.weights,
+        settings.scorers,
     )
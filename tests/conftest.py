@@ -0,0 +1,59 @@
+import json
+import sys
+from pathlib import Path
+
+import ollama
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+async def fake_chat(model: str = "", messages=None, format=None, **kwargs):
+    """Judges get mid-range scores, everything else an echo of the last message."""
+    if format:
+        content = json.dumps(dict.fromkeys(format["properties"], 50))
+    else:
+        content = f"reply to: {messages[-1]['content'] if messages else ''}"
+    return ollama.ChatResponse(
+        model=model,
+        message=ollama.Message(role="assistant", content=content),
+        prompt_eval_count=10,
+        eval_count=5,
+        done=True,
+    )
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    """app.py with a fake model and NRCLex, writing its session databases to `tmp_path`."""
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(sys, "argv", ["app.py"])
+    import app
+    import llm
+    import metacognitive
+
+    monkeypatch.setattr(llm.client, "chat", fake_chat)
+    monkeypatch.setattr(
+        metacognitive,
+        "_affect_frequencies",
+        lambda message: tuple(
+            (name, 0.1)
+            for name in (
+                "fear",
+                "anger",
+                "anticipation",
+                "trust",
+                "surprise",
+                "positive",
+                "negative",
+                "sadness",
+                "disgust",
+                "joy",
+            )
+        ),
+    )
+    # System 2 is a separate instance, not running here
+    monkeypatch.setattr(app, "should_escalate", lambda *args: False)
+    monkeypatch.chdir(tmp_path)
+    return app
@@ -0,0 +1,38 @@
+import asyncio
+
+import ollama
+
+import scheduler
+from batching import MicroBatcher
+from scheduler import Priority, priority
+
+
+def test_embeddings_are_sent_together_at_the_most_urgent_priority():
+    sent = []
+
+    async def send_embed(model, texts):
+        sent.append((scheduler.current_priority(), texts))
+        return ollama.EmbedResponse(
+            model=model,
+            embeddings=[[float(len(text))] for text in texts],
+            prompt_eval_count=len(texts),
+        )
+
+    async def run():
+        batcher = MicroBatcher(send_embed, window=0.001)
+
+        async def embed(texts, level):
+            with priority(level):
+                return await batcher.embed("embedder", texts)
+
+        return await asyncio.gather(
+            embed(["a", "bb"], Priority.Experiment),
+            embed(["ccc"], Priority.Interactive),
+        )
+
+    experiment, interactive = asyncio.run(run())
+
+    assert sent == [(Priority.Interactive, ["a", "bb", "ccc"])]
+    # each caller gets its own texts' embeddings back
+    assert experiment.embeddings == [[1.0], [2.0]]
+    assert interactive.embeddings == [[3.0]]
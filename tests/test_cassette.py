@@ -0,0 +1,28 @@
+import asyncio
+
+import ollama
+
+import llm
+from llm import CassetteMode
+
+
+def test_replayed_embeddings_keep_their_tokens(monkeypatch, tmp_path):
+    async def embed(model, input, **kwargs):
+        return ollama.EmbedResponse(
+            model=model,
+            embeddings=[[float(len(text))] for text in input],
+            prompt_eval_count=9,
+        )
+
+    monkeypatch.setattr(llm.client, "embed", embed)
+    path = str(tmp_path / "cassette.sqlite3")
+    texts = ["a short one", "and a rather longer text"]
+
+    llm.use_cassette(path, CassetteMode.Record)
+    recorded = asyncio.run(llm._embed("embedder", texts, batched=False))
+    llm.use_cassette(path, CassetteMode.Replay)
+    replayed = asyncio.run(llm._embed("embedder", texts, batched=False))
+    llm.use_cassette(None)
+
+    assert replayed.embeddings == recorded.embeddings
+    assert replayed.prompt_eval_count == recorded.prompt_eval_count == 9
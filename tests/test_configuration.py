@@ -0,0 +1,22 @@
+import asyncio
+
+import httpx
+
+
+def test_unknown_trigger_dimension_is_rejected(app):
+    configuration = {
+        "prompts": {},
+        "escalation": {"dimension_triggers": {"corectness": {"above": 80}}},
+    }
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await client.post("/sessions", json=configuration)
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 422
+    assert "corectness" in response.text
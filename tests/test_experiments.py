@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+import httpx
+
+
+def test_experiments_stream_every_prompt(app):
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            response = await client.post(
+                "/experiments",
+                json={
+                    "experiments": [
+                        {"id": "first", "prompts": ["Hello", "And then?"]},
+                        {"id": "second", "prompts": ["Why is the sky blue?"]},
+                    ]
+                },
+            )
+            return response
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(
+        (result["experiment_id"], result["prompt_index"]) for result in results
+    ) == [
+        ("first", 0),
+        ("first", 1),
+        ("second", 0),
+    ]
+    assert all(result["error"] is None for result in results)
+    assert all(result["response"].startswith("reply to:") for result in results)
+
+
+def test_experiment_turns_keep_no_chart_state(app):
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            session_id = (await client.post("/sessions")).json()["session_id"]
+            return await client.post(
+                "/system1", json={"user_input": "Hello", "session_id": session_id}
+            )
+
+    app.msv_state.clear()
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert not app.msv_state
+    assert not app.system_two_state
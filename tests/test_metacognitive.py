@@ -0,0 +1,53 @@
+import asyncio
+
+import metacognitive
+import similarity
+from metacognitive import ConflictInformation
+from similarity import Scorer, ScorerConfiguration
+
+
+def test_conflict_information_without_references_scores_internal_consistency(
+    monkeypatch,
+):
+    async def internal_consistency(message, model):
+        return 80.0
+
+    monkeypatch.setattr(similarity, "internal_consistency", internal_consistency)
+
+    conflict_information = asyncio.run(
+        metacognitive._compute_conflict_information(
+            "The sky is blue. It scatters short wavelengths.",
+            sources="",
+            temporal_info="",
+            prompts=None,
+            weights={},
+            scorers=ScorerConfiguration(conflict_information=Scorer.Embedding),
+        )
+    )
+
+    # no sources or temporal information to disagree with, not total disagreement
+    assert conflict_information.source_agreement == 80.0
+    assert conflict_information.temporal_stability == 80.0
+    assert conflict_information.calculated_value == 80
+
+
+def test_fill_unscored_matches_renormalized_weights():
+    weights = {
+        "weight_internal_consistency": 0.3,
+        "weight_source_agreement": 0.4,
+        "weight_temporal_stability": 0.3,
+    }
+    scores = metacognitive._fill_unscored(
+        ConflictInformation,
+        {
+            "internal_consistency": 60.0,
+            "source_agreement": 90.0,
+            "temporal_stability": None,
+        },
+        weights,
+    )
+
+    assert scores["temporal_stability"] == (60.0 * 0.3 + 90.0 * 0.4) / 0.7
+    assert ConflictInformation(**scores, **weights).calculated_value == int(
+        (60.0 * 0.3 + 90.0 * 0.4) / 0.7
+    )
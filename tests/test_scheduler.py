@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from scheduler import ModelQueue, Priority
+
+
+def test_cancel_then_release():
+    async def run():
+        queue = ModelQueue("model", slots=1, max_waiting=8)
+        await queue.acquire(Priority.Interactive)
+        cancelled = asyncio.create_task(queue.acquire(Priority.Judge))
+        waiting = asyncio.create_task(queue.acquire(Priority.Experiment))
+        await asyncio.sleep(0)
+
+        # both in the same loop pass: release pops the cancelled waiter's entry first
+        cancelled.cancel()
+        queue.release()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+        # the slot went on to the next waiter
+        await asyncio.wait_for(waiting, 1)
+        assert queue.active == 1
+        assert not queue.waiting
+        assert sum(queue.depth.values()) == 0
+
+    asyncio.run(run())
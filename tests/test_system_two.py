@@ -0,0 +1,73 @@
+import asyncio
+
+import httpx
+
+
+def test_invalid_settings_are_rejected_with_422(app):
+    request = {
+        "user_prompt": "Hello",
+        "system_one_response": "Hi",
+        "metacognitive_vector": {},
+        "settings_id": "invalid",
+        # the System 2 configuration's validator raises ValueError for no roles
+        "settings": {"prompts": {}, "weights": {}, "system_two": {"roles": {}}},
+    }
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await client.post("/system2", json=request)
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 422
+    assert "at least one role" in response.text
+
+
+def test_settings_id_survives_the_round_trip(app, monkeypatch):
+    import system_two_model
+    from metacognitive import _DIMENSION_TYPES, _score_names
+    from system_communication_objects import SystemTwoRequest
+
+    session = app.create_session(
+        *app._split_configuration(None), set(app.sessions), app.context_configuration
+    )
+    # None means disabled, and must not arrive as the default
+    session.system_two.deliberation.stop_correctness = None
+    sent = []
+
+    async def record(request):
+        sent.append(request.content)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.app)
+        client = httpx.AsyncClient(
+            transport=transport, event_hooks={"request": [record]}
+        )
+        monkeypatch.setattr(app, "system_two_client", client)
+        monkeypatch.setattr(app.app_args, "system_two_url", "http://test")
+        async with client:
+            for _ in range(2):
+                response = await app._post_to_system_two(
+                    session,
+                    SystemTwoRequest(
+                        user_prompt="Hello",
+                        system_one_response="Hi",
+                        metacognitive_vector={
+                            dimension: [50.0] * len(_score_names(dimension_type))
+                            for dimension, dimension_type in _DIMENSION_TYPES.items()
+                        },
+                        settings_id=session.system_two_settings_id,
+                    ),
+                )
+                assert response.status_code == 200
+
+    asyncio.run(run())
+
+    settings, _ = system_two_model._settings[session.system_two_settings_id]
+    assert settings.system_two.deliberation.stop_correctness is None
+    # the second request only named the settings, and System 2 had them cached
+    assert len(sent) == 2
+    assert b'"settings":null' in sent[1]
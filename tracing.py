@@ -0,0 +1,232 @@
+"""Spans over the request pipeline, exported as OTLP/JSON.
+
+Every `accounting.timed` stage is a span; the coarser steps around them are `traced`. A span started while handling a /system2 request continues the trace System 1
+sent in its `traceparent` header, so both halves of a turn show up as one trace.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import secrets
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+
+import httpx
+
+# W3C trace context: version-trace id-parent span id-flags
+TRACEPARENT = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}")
+# spans kept waiting for export at most, beyond that they're dropped
+MAX_PENDING_SPANS = 10000
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_ns: int
+    end_ns: int = 0
+    attributes: dict[str, str | int | float] = field(default_factory=dict)
+    error: str | None = None
+
+
+# The innermost span running in this task
+_current: ContextVar[Span | None] = ContextVar("span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes: str | int | float) -> Iterator[Span]:
+    parent = _current.get()
+    current = Span(
+        name=name,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        start_ns=time.time_ns(),
+        attributes=attributes,
+    )
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current.reset(token)
+        if exporter is not None:
+            exporter.add(current)
+
+
+def traced(name: str) -> Callable[[Callable[..., Awaitable]], Callable[..., Awaitable]]:
+    """Run every call of the decorated coroutine function in a span named `name`."""
+
+    def decorator(function: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def traceparent() -> str | None:
+    """The header that makes the current span the parent of the callee's spans."""
+    current = _current.get()
+    if current is None:
+        return None
+    return f"00-{current.trace_id}-{current.span_id}-01"
+
+
+@contextmanager
+def continue_trace(header: str | None) -> Iterator[None]:
+    """Parent the spans started inside on the caller's span, given its `traceparent`."""
+    match = TRACEPARENT.fullmatch(header or "")
+    if match is None:
+        yield
+        return
+    # stands in for the caller's span, which is exported by the caller
+    remote = Span(
+        name="remote",
+        trace_id=match[1],
+        span_id=match[2],
+        parent_id=None,
+        start_ns=0,
+    )
+    token = _current.set(remote)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def _attribute(key: str, value: str | int | float) -> dict:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return {"key": key, "value": {"stringValue": str(value)}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"doubleValue": value}}
+
+
+class SpanExporter:
+    """Batches finished spans and exports them every `interval` seconds as OTLP/JSON: one
+    export request per line of `file`, and/or POSTed to an OTLP/HTTP collector."""
+
+    def __init__(
+        self,
+        service_name: str,
+        file: str | None = None,
+        otlp_endpoint: str | None = None,
+        interval: float = 1.0,
+    ):
+        self.service_name = service_name
+        self.file = Path(file) if file else None
+        self.otlp_endpoint = otlp_endpoint.rstrip("/") if otlp_endpoint else None
+        self.interval = interval
+        self.pending: list[Span] = []
+        self.dropped = 0
+        self.client = httpx.AsyncClient(timeout=10) if otlp_endpoint else None
+
+    def add(self, span: Span) -> None:
+        if len(self.pending) >= MAX_PENDING_SPANS:
+            self.dropped += 1
+            return
+        self.pending.append(span)
+
+    def export_request(self, spans: list[Span]) -> dict:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [_attribute("service.name", self.service_name)]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "system_friends"},
+                            "spans": [
+                                {
+                                    "traceId": span.trace_id,
+                                    "spanId": span.span_id,
+                                    **(
+                                        {"parentSpanId": span.parent_id}
+                                        if span.parent_id
+                                        else {}
+                                    ),
+                                    "name": span.name,
+                                    # internal
+                                    "kind": 1,
+                                    "startTimeUnixNano": str(span.start_ns),
+                                    "endTimeUnixNano": str(span.end_ns),
+                                    "attributes": [
+                                        _attribute(key, value)
+                                        for key, value in span.attributes.items()
+                                    ],
+                                    "status": (
+                                        {"code": 2, "message": span.error}
+                                        if span.error
+                                        else {}
+                                    ),
+                                }
+                                for span in spans
+                            ],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    async def flush(self) -> None:
+        if self.dropped:
+            logging.warning(f"Dropped {self.dropped} spans, export can't keep up")
+            self.dropped = 0
+        if not self.pending:
+            return
+        spans, self.pending = self.pending, []
+        request = self.export_request(spans)
+        if self.file:
+            with self.file.open("a") as file:
+                file.write(json.dumps(request) + "\n")
+        if self.client:
+            try:
+                response = await self.client.post(
+                    f"{self.otlp_endpoint}/v1/traces", json=request
+                )
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                logging.warning(f"Unable to export {len(spans)} spans: {e}")
+
+    async def run(self) -> None:
+        """Export until cancelled, then once more for the spans still waiting."""
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await self.flush()
+        finally:
+            await self.flush()
+            if self.client:
+                await self.client.aclose()
+
+
+# Set by `configure`, spans aren't kept when nothing exports them
+exporter: SpanExporter | None = None
+
+
+def configure(
+    service_name: str, file: str | None = None, otlp_endpoint: str | None = None
+) -> SpanExporter | None:
+    global exporter
+    exporter = (
+        SpanExporter(service_name, file, otlp_endpoint)
+        if file or otlp_endpoint
+        else None
+    )
+    return exporter